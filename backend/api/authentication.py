@@ -0,0 +1,86 @@
+"""
+Cached JWT authentication for the REST API and the chat WebSocket.
+
+Validating a token and fetching its user happens on every request and every
+WebSocket connect. Both results are kept in bounded per-process LRU caches
+(see AUTH_CACHE in settings):
+
+- validated access tokens, keyed by the raw token and never kept past the
+  token's own expiry;
+- users, keyed by id, stored as their column values without the password
+  hash. Every lookup builds a fresh User from them, so one request cannot
+  leak changes into another.
+
+The handlers in api/signals.py drop a user's entry when the user is saved or
+deleted. Other processes catch up within TIMEOUT seconds.
+"""
+import time
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import LRUCache
+from .models import User
+
+OPTIONS = getattr(settings, 'AUTH_CACHE', {})
+TIMEOUT = OPTIONS.get('TIMEOUT', 300)
+
+tokens = LRUCache(OPTIONS.get('TOKEN_ENTRIES', 10000), TIMEOUT)
+users = LRUCache(OPTIONS.get('USER_ENTRIES', 10000), TIMEOUT)
+
+# Columns kept for a cached user; the password is loaded on demand
+USER_COLUMNS = [field.attname for field in User._meta.concrete_fields if field.name != 'password']
+
+
+def load_user(user_id):
+    """The user with `user_id`, or None; hits the database only on a cache miss."""
+    values = users.get(user_id)
+    if values is None:
+        values = User.objects.filter(pk=user_id).values_list(*USER_COLUMNS).first()
+        if values is None:
+            return None
+        users.set(user_id, values)
+    return User.from_db(User.objects.db, USER_COLUMNS, values)
+
+
+def cached_user(user_id):
+    """The cached user with `user_id` if there is one, without touching the database."""
+    values = users.get(user_id)
+    return None if values is None else User.from_db(User.objects.db, USER_COLUMNS, values)
+
+
+def forget_user(user_id):
+    users.delete(user_id)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """simplejwt's JWTAuthentication, with the token and user lookups cached."""
+
+    def get_validated_token(self, raw_token):
+        key = raw_token.decode() if isinstance(raw_token, bytes) else raw_token
+        token = tokens.get(key)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            remaining = token.get('exp', time.time() + TIMEOUT) - time.time()
+            tokens.set(key, token, max(0, min(TIMEOUT, remaining)))
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        user = load_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the password hash, which is not cached
+            return super().get_user(validated_token)
+        return user
+
+
+authenticator = CachedJWTAuthentication()
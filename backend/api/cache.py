@@ -0,0 +1,156 @@
+"""
+Small caching helpers shared by the API.
+
+`LRUCache` is a bounded, thread-safe in-process cache with a per-entry TTL
+and the get/set/delete surface of a Django cache, so either can sit behind
+`ResponseCache`.
+
+`ResponseCache` stores serialized response data together with the version
+of every entity it was built from ("post:12", "user:3", "timeline:3", ...).
+Signal handlers bump those versions on writes, and an entry whose recorded
+versions no longer match is treated as a miss. Versions are opaque tokens
+rather than counters, so a version that gets evicted comes back as a fresh
+token and simply invalidates its dependents.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache:
+    """`on_evict(key)`, if given, hears about entries dropped for space or age."""
+    def __init__(self, max_entries=1000, timeout=300, on_evict=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.evicted(key)
+            self.misses += 1
+            return default
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout=-1):
+        timeout = self.timeout if timeout == -1 else timeout
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self.evicted(self._data.popitem(last=False)[0])
+
+    def set_many(self, data, timeout=-1):
+        for key, value in data.items():
+            self.set(key, value, timeout)
+        return []
+
+    def evicted(self, key):
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def add(self, key, value, timeout=-1):
+        with self._lock:
+            if key in self._data:
+                _, expires_at = self._data[key]
+                if expires_at is None or expires_at > time.monotonic():
+                    return False
+        self.set(key, value, timeout)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResponseCache:
+    def __init__(self, store, versions, timeout=60):
+        self.store = store
+        self.versions_store = versions
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'RESPONSE_CACHE', {})
+        timeout = options.get('TIMEOUT', 60)
+        if options.get('BACKEND', 'lru') == 'django':
+            store = caches[options.get('ALIAS', 'default')]
+            return cls(store, store, timeout)
+        max_entries = options.get('MAX_ENTRIES', 1000)
+        # Versions outlive the entries that depend on them
+        return cls(LRUCache(max_entries, timeout), LRUCache(max_entries * 10, None), timeout)
+
+    def version_key(self, name):
+        return f'version:{name}'
+
+    def versions(self, *names):
+        """Current version token of each named entity."""
+        keys = {self.version_key(name): name for name in names}
+        found = self.versions_store.get_many(list(keys))
+        versions = {}
+        for key, name in keys.items():
+            if key not in found:
+                self.versions_store.add(key, time.time_ns(), None)
+                found[key] = self.versions_store.get(key)
+            versions[name] = found[key]
+        return versions
+
+    def bump(self, *names):
+        if names:
+            version = time.time_ns()
+            self.versions_store.set_many({self.version_key(name): version for name in names}, None)
+
+    def get(self, key):
+        entry = self.store.get(f'response:{key}')
+        if entry is None:
+            return None
+        if self.versions(*entry['versions']) != entry['versions']:
+            return None
+        return entry['data']
+
+    def set(self, key, data, versions):
+        """
+        Store `data` built from entities at `versions`. Read the versions
+        before building the data, so a write that lands in between leaves
+        the entry stale instead of hiding the write.
+        """
+        self.store.set(f'response:{key}', {'versions': versions, 'data': data}, self.timeout)
+
+    def clear(self):
+        self.store.clear()
+        if self.versions_store is not self.store:
+            self.versions_store.clear()
+
+
+response_cache = ResponseCache.from_settings()
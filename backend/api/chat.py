@@ -0,0 +1,222 @@
+"""
+Chat state shared by ChatConsumer (api/consumers.py) and the conversation
+views.
+
+Conversation participants never change after creation, so the pair of user
+ids of each conversation is kept in a bounded per-process LRU cache (see
+CHAT in settings). Socket connects, including the reconnect storm after a
+deploy, check membership from memory; the handlers in api/signals.py drop an
+entry when its conversation is saved or deleted.
+
+Chat lines sent over the socket are saved by `writer`, a write-behind queue
+that group-commits the messages of every consumer in the process: whatever
+arrives while the previous batch is being written, or within FLUSH_DELAY
+seconds, goes into the next single-transaction insert.
+
+Reading is tracked with one watermark per participant
+(ConversationParticipant.last_read_id) rather than a flag per message:
+marking a whole history as read is a single UPDATE, and a message is read
+once the recipient's watermark has reached its id.
+
+The same rows are the users' inboxes: every path that saves messages
+(`writer` and MessageViewSet.create) calls `record_messages` in the same
+transaction, so listing conversations by recent activity with their last
+message and unread count is one indexed query.
+"""
+import asyncio
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, Count, F, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import LRUCache
+from .models import Conversation, ConversationParticipant, Message
+
+OPTIONS = getattr(settings, 'CHAT', {})
+READ_RECEIPT_DELAY = OPTIONS.get('READ_RECEIPT_DELAY', 0.5)
+
+participants_cache = LRUCache(OPTIONS.get('PARTICIPANT_ENTRIES', 10000), OPTIONS.get('PARTICIPANT_TIMEOUT', 3600))
+
+
+def cached_participants(conversation_id):
+    """(initiator_id, receiver_id) from the cache, or None without touching the database."""
+    return participants_cache.get(int(conversation_id))
+
+
+def participants(conversation_id):
+    """(initiator_id, receiver_id) of the conversation, or None if it does not exist."""
+    conversation_id = int(conversation_id)
+    ids = participants_cache.get(conversation_id)
+    if ids is None:
+        ids = Conversation.objects.filter(pk=conversation_id).values_list('initiator_id', 'receiver_id').first()
+        if ids is not None:
+            participants_cache.set(conversation_id, ids)
+    return ids
+
+
+def is_participant(conversation_id, user_id):
+    ids = participants(conversation_id)
+    return ids is not None and user_id in ids
+
+
+def forget_conversation(conversation_id):
+    participants_cache.delete(int(conversation_id))
+
+
+def create_participants(conversation):
+    ConversationParticipant.objects.bulk_create(
+        [ConversationParticipant(conversation=conversation, user_id=user_id, last_activity=conversation.start_timestamp)
+         for user_id in {conversation.initiator_id, conversation.receiver_id}],
+        ignore_conflicts=True,
+    )
+
+
+def read_marks(conversation_id):
+    """{user id: last read message id} for the participants of a conversation"""
+    return dict(
+        ConversationParticipant.objects.filter(conversation_id=conversation_id).values_list('user_id', 'last_read_id')
+    )
+
+
+def is_read(message, marks):
+    """Whether someone other than the sender has read up to `message`"""
+    return any(user_id != message.sender_id and message.id <= mark for user_id, mark in marks.items())
+
+
+def unread_messages(conversation_id, user_id, last_read_id):
+    return Message.objects.filter(conversation_id=conversation_id, id__gt=last_read_id).exclude(sender_id=user_id)
+
+
+def mark_read(conversation_id, user_id, message_id):
+    """
+    Move the user's watermark up to `message_id` and recount their unread
+    messages, in one UPDATE. The watermark never moves back and stops at the
+    last message that exists, so clients can send whatever id they scrolled to.
+    Returns the watermark stored, or None if it did not move.
+    """
+    latest = (
+        Message.objects.filter(conversation_id=conversation_id, id__lte=message_id)
+        .order_by('-id').values_list('id', flat=True).first()
+    )
+    if latest is None:
+        return None
+    unread = (
+        unread_messages(conversation_id, user_id, latest)
+        .order_by().values('conversation_id').annotate(total=Count('id')).values('total')
+    )
+    updated = ConversationParticipant.objects.filter(
+        conversation_id=conversation_id, user_id=user_id, last_read_id__lt=latest,
+    ).update(last_read_id=latest, unread_count=Coalesce(Subquery(unread), 0))
+    return latest if updated else None
+
+
+def record_messages(messages):
+    """
+    Fold newly saved messages into the inbox rows of their conversations:
+    one UPDATE per conversation moves its last message and activity forward
+    and adds to each recipient's unread count.
+    """
+    by_conversation = {}
+    for message in messages:
+        by_conversation.setdefault(message.conversation_id, []).append(message)
+    for conversation_id, received in by_conversation.items():
+        last = max(received, key=lambda message: message.id)
+        unread = [
+            When(user_id=user_id, then=Value(sum(message.sender_id != user_id for message in received)))
+            for user_id in set(participants(conversation_id) or ())
+        ]
+        ConversationParticipant.objects.filter(conversation_id=conversation_id).update(
+            last_message_id=Greatest(Coalesce(F('last_message_id'), 0), last.id),
+            last_activity=Greatest(F('last_activity'), last.timestamp),
+            unread_count=F('unread_count') + Case(*unread, default=0),
+        )
+
+
+def refresh_inbox(conversation_id):
+    """Recompute the inbox rows of a conversation, after messages were deleted"""
+    last = Message.objects.filter(conversation_id=conversation_id).order_by('-id').only('id', 'timestamp').first()
+    for participant in ConversationParticipant.objects.filter(conversation_id=conversation_id):
+        participant.last_message = last
+        if last is not None:
+            participant.last_activity = last.timestamp
+        participant.unread_count = unread_messages(conversation_id, participant.user_id, participant.last_read_id).count()
+        participant.save(update_fields=['last_message', 'last_activity', 'unread_count'])
+
+
+class MessageWriter:
+    def __init__(self, delay=0.002, max_batch=100):
+        self.delay = delay
+        self.max_batch = max_batch
+        self.pending = []
+        self.flusher = None
+
+    async def write(self, message):
+        """Queue an unsaved Message and return it once it is saved, with its id."""
+        loop = asyncio.get_running_loop()
+        if self.flusher is not None and self.flusher.get_loop() is not loop:
+            # Futures of a closed loop can never be resolved
+            self.pending, self.flusher = [], None
+        future = loop.create_future()
+        self.pending.append((message, future))
+        if self.flusher is None or self.flusher.done():
+            self.flusher = loop.create_task(self.flush())
+        return await future
+
+    async def flush(self):
+        # One batch at a time, so messages are saved in the order they arrived
+        while self.pending:
+            if self.delay and len(self.pending) < self.max_batch:
+                await asyncio.sleep(self.delay)
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            messages = [message for message, _ in batch]
+            try:
+                errors = await database_sync_to_async(self.save)(messages)
+            except Exception as error:
+                errors = [error] * len(batch)
+            for (message, future), error in zip(batch, errors):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(message)
+                else:
+                    future.set_exception(error)
+
+    def save(self, messages):
+        """
+        Insert `messages` in order in one transaction and return the error of
+        each (None when saved). If the batch fails, for instance because a
+        conversation was deleted meanwhile, the messages are retried one by
+        one so only the offending ones fail.
+        """
+        try:
+            with transaction.atomic():
+                self.insert(messages)
+            return [None] * len(messages)
+        except DatabaseError:
+            if len(messages) == 1:
+                raise
+        errors = []
+        for message in messages:
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    self.insert([message])
+                errors.append(None)
+            except DatabaseError as error:
+                errors.append(error)
+        return errors
+
+    def insert(self, messages):
+        if connection.features.can_return_rows_from_bulk_insert:
+            Message.objects.bulk_create(messages)
+        else:
+            # MySQL does not report the ids of a multi-row insert; the single
+            # transaction still saves all but one commit per message
+            for message in messages:
+                message.save(force_insert=True)
+        record_messages(messages)
+
+
+writer = MessageWriter(OPTIONS.get('FLUSH_DELAY', 0.002), OPTIONS.get('MAX_BATCH', 100))
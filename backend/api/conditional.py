@@ -0,0 +1,39 @@
+"""
+Conditional GET support for APIViews.
+
+Views compute an ETag (and, where one timestamp covers the whole payload, a
+Last-Modified date) from a narrow query on version columns, before doing any
+serialization. `not_modified` answers 304 when the client's copy is still
+current; otherwise `with_validators` stamps the fresh response.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """The 304 (or 412) response to return if the client's copy is current, else None."""
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp(last_modified))
+    if response is not None:
+        with_validators(response, etag, last_modified)
+    return response
+
+
+def with_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(timestamp(last_modified))
+    # Payloads depend on who is asking; let clients keep them but revalidate
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -1,9 +1,11 @@
 # consumers.py
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from .models import Conversation, Message
+from . import chat
+from .models import Message
 from .serializers import MessageSerializer
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -19,12 +21,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
+        # Highest message id the user has read, and the part of it already sent
+        self.read_up_to = 0
+        self.read_sent = 0
+        self.read_receipt_task = None
         self.room_group_name = f'chat_{self.conversation_id}'
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
+            if self.read_receipt_task is not None:
+                self.read_receipt_task.cancel()
+                await self.send_read_receipt()
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
@@ -42,7 +51,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         message = await self.create_message(content)
-        serializer = MessageSerializer(message)
+        if data.get('client_id') is not None:
+            # Lets the sender match its optimistic copy to the saved message
+            await self.send(text_data=json.dumps({
+                'type': 'message_ack',
+                'client_id': data['client_id'],
+                'message_id': message.id,
+            }))
+        # A message that was just written has not been read by anyone yet
+        serializer = MessageSerializer(message, context={'read_marks': {}})
         
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -53,16 +70,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def handle_read_receipt(self, data):
-        message_id = data.get('message_id')
-        if not message_id:
+        try:
+            message_id = int(data.get('message_id') or 0)
+        except (TypeError, ValueError):
+            return
+        if message_id <= self.read_up_to:
             return
         
-        await self.mark_message_as_read(message_id)
+        # Receipts sent while scrolling are coalesced into one write and one broadcast
+        self.read_up_to = message_id
+        if self.read_receipt_task is None:
+            self.read_receipt_task = asyncio.create_task(self.debounce_read_receipt())
+
+    async def debounce_read_receipt(self):
+        await asyncio.sleep(chat.READ_RECEIPT_DELAY)
+        self.read_receipt_task = None
+        await self.send_read_receipt()
+
+    async def send_read_receipt(self):
+        message_id = self.read_up_to
+        if message_id <= self.read_sent:
+            return
+        self.read_sent = message_id
+        # Peers get the watermark actually stored, never the raw client id
+        stored = await self.mark_messages_as_read(message_id)
+        if stored is None:
+            return
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'read_receipt',
-                'message_id': message_id
+                'user_id': self.user.pk,
+                'message_id': stored
             }
         )
 
@@ -72,26 +111,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def read_receipt(self, event):
         await self.send(text_data=json.dumps(event))
 
-    @database_sync_to_async
-    def is_participant(self):
-        return Conversation.objects.filter(
-            id=self.conversation_id,
-            participants=self.user
-        ).exists()
+    async def is_participant(self):
+        ids = chat.cached_participants(self.conversation_id)
+        if ids is None:
+            ids = await database_sync_to_async(chat.participants)(self.conversation_id)
+        return ids is not None and self.user.pk in ids
 
-    @database_sync_to_async
-    def create_message(self, content):
-        conversation = Conversation.objects.get(id=self.conversation_id)
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=self.user,
-            content=content
-        )
-        return message
+    async def create_message(self, content):
+        message = Message(conversation_id=int(self.conversation_id), sender=self.user, content=content)
+        return await chat.writer.write(message)
 
     @database_sync_to_async
-    def mark_message_as_read(self, message_id):
-        Message.objects.filter(
-            id=message_id,
-            conversation_id=self.conversation_id
-        ).exclude(sender=self.user).update(read=True)
\ No newline at end of file
+    def mark_messages_as_read(self, message_id):
+        return chat.mark_read(self.conversation_id, self.user.pk, message_id)
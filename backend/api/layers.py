@@ -0,0 +1,245 @@
+"""
+A channel layer that passes messages through the database, so consumers in
+different ASGI processes (and on different hosts) share groups without a
+Redis server.
+
+Messages are ChannelMessage rows and group memberships are
+ChannelGroupMembership rows, both with an expiry. Each process names its
+channels `<process id>.<prefix>!<random>` and runs one poller task that
+fetches every message addressed to the process in a single indexed query and
+hands them to the waiting receive() calls, so idle sockets cost nothing and
+the database sees one poll per process rather than one per connection.
+The poll interval backs off while the process is idle and after database
+errors, which the poller logs and survives; waiting receive() calls also
+restart it if it ever stops.
+
+Configure it in CHANNEL_LAYERS with the same options as the built-in layers
+(expiry, group_expiry, capacity, channel_capacity) plus poll_interval,
+max_poll_interval and poller_check_interval in seconds. `manage.py benchmark_channel_layer` compares it
+with the in-memory layer.
+"""
+import asyncio
+import json
+import logging
+import random
+import string
+import time
+import uuid
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ChannelGroupMembership, ChannelMessage
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 poll_interval=0.005, max_poll_interval=0.1, poller_check_interval=1.0, batch_size=100, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poller_check_interval = poller_check_interval
+        self.batch_size = batch_size
+        self.client_prefix = uuid.uuid4().hex
+        # Process-local channel -> queue of (expires_at, message), fed by the poller
+        self.buffers = {}
+        self.waiting = {}
+        self.poller = None
+
+    # Channel API
+
+    async def new_channel(self, prefix='specific'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{self.client_prefix}.{prefix}!{suffix}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        if not await self.write([channel], message, check_capacity=True):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if self.is_local(channel):
+            return await self.receive_local(channel)
+        # Channels shared between processes are polled on their own
+        delay = self.poll_interval
+        while True:
+            messages = await self.fetch(channel, limit=1)
+            if messages:
+                return messages[0][1]
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    async def flush(self):
+        self.buffers.clear()
+        await database_sync_to_async(self.delete_all)()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await database_sync_to_async(self.add_membership)(group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await database_sync_to_async(
+            ChannelGroupMembership.objects.filter(group=group, channel=channel).delete
+        )()
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        channels = await database_sync_to_async(self.group_channels)(group)
+        if channels:
+            # Full channels silently miss group messages, as in the other layers
+            await self.write(channels, message, check_capacity=True)
+
+    # Process-local channels
+
+    def is_local(self, channel):
+        return channel.startswith(f'{self.client_prefix}.') and '!' in channel
+
+    async def receive_local(self, channel):
+        queue = self.buffers.setdefault(channel, asyncio.Queue())
+        self.waiting[channel] = self.waiting.get(channel, 0) + 1
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            while True:
+                self.ensure_poller()
+                # Wake up now and then to restart a poller that has stopped
+                done, _ = await asyncio.wait({getter}, timeout=self.poller_check_interval)
+                if not done:
+                    continue
+                expires_at, message = getter.result()
+                if expires_at > time.time():
+                    return message
+                getter = asyncio.ensure_future(queue.get())
+        finally:
+            getter.cancel()
+            self.waiting[channel] -= 1
+            if not self.waiting[channel]:
+                del self.waiting[channel]
+
+    def ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self.poller is None or self.poller.done() or self.poller.get_loop() is not loop:
+            self.poller = loop.create_task(self.poll())
+
+    async def poll(self):
+        delay = self.poll_interval
+        sweep_at = time.monotonic() + self.expiry
+        while True:
+            try:
+                messages = await self.fetch_local()
+                for channel, expires_at, message in messages:
+                    self.buffers.setdefault(channel, asyncio.Queue()).put_nowait((expires_at, message))
+                if time.monotonic() > sweep_at:
+                    self.sweep()
+                    await database_sync_to_async(self.delete_expired)()
+                    sweep_at = time.monotonic() + self.expiry
+            except Exception:
+                # A lost connection must not strand the sockets waiting on this process
+                logger.exception('Channel layer poll failed')
+                delay = self.max_poll_interval
+                await asyncio.sleep(delay)
+                continue
+            if len(messages) == self.batch_size:
+                continue
+            delay = self.poll_interval if messages else min(delay * 2, self.max_poll_interval)
+            await asyncio.sleep(delay)
+
+    def sweep(self):
+        """Forget buffers of channels nobody receives on once their messages have expired."""
+        now = time.time()
+        for channel, queue in list(self.buffers.items()):
+            if channel in self.waiting:
+                continue
+            pending = []
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item[0] > now:
+                    pending.append(item)
+            if pending:
+                for item in pending:
+                    queue.put_nowait(item)
+            else:
+                del self.buffers[channel]
+
+    # Database side, run in database_sync_to_async
+
+    def decode(self, rows):
+        return [(channel, expires.timestamp(), json.loads(message)) for channel, expires, message in rows]
+
+    async def fetch(self, channel, limit):
+        rows = await database_sync_to_async(self.take)(ChannelMessage.objects.filter(channel=channel), limit)
+        return [(expires, message) for _, expires, message in rows]
+
+    async def fetch_local(self):
+        # Local channel names start with the process id: one range scan on the channel index
+        queryset = ChannelMessage.objects.filter(channel__startswith=f'{self.client_prefix}.')
+        return await database_sync_to_async(self.take)(queryset, self.batch_size)
+
+    def take(self, queryset, limit):
+        """Remove and return the oldest unexpired messages of `queryset`."""
+        rows = list(
+            queryset.filter(expires__gt=timezone.now())
+            .order_by('id')
+            .values_list('id', 'channel', 'expires', 'message')[:limit]
+        )
+        if rows:
+            ChannelMessage.objects.filter(id__in=[row[0] for row in rows]).delete()
+        return self.decode([row[1:] for row in rows])
+
+    async def write(self, channels, message, check_capacity=False):
+        return await database_sync_to_async(self.insert)(channels, message, check_capacity)
+
+    def insert(self, channels, message, check_capacity):
+        """Queue `message` on each channel with room for it; returns how many took it."""
+        now = timezone.now()
+        if check_capacity:
+            pending = dict(
+                ChannelMessage.objects.filter(channel__in=channels, expires__gt=now)
+                .values('channel').annotate(total=Count('id')).values_list('channel', 'total')
+            )
+            channels = [channel for channel in channels if pending.get(channel, 0) < self.get_capacity(channel)]
+        expires = now + timedelta(seconds=self.expiry)
+        body = json.dumps(message, cls=DjangoJSONEncoder)
+        ChannelMessage.objects.bulk_create([
+            ChannelMessage(channel=channel, message=body, expires=expires) for channel in channels
+        ])
+        return len(channels)
+
+    def add_membership(self, group, channel):
+        ChannelGroupMembership.objects.update_or_create(
+            group=group, channel=channel,
+            defaults={'expires': timezone.now() + timedelta(seconds=self.group_expiry)},
+        )
+
+    def group_channels(self, group):
+        return list(
+            ChannelGroupMembership.objects.filter(group=group, expires__gt=timezone.now())
+            .values_list('channel', flat=True)
+        )
+
+    def delete_expired(self):
+        now = timezone.now()
+        ChannelMessage.objects.filter(expires__lte=now).delete()
+        ChannelGroupMembership.objects.filter(expires__lte=now).delete()
+
+    def delete_all(self):
+        ChannelMessage.objects.all().delete()
+        ChannelGroupMembership.objects.all().delete()
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from api.layers import DatabaseChannelLayer
+
+LAYERS = {
+    'memory': InMemoryChannelLayer,
+    'database': DatabaseChannelLayer,
+}
+
+
+class Command(BaseCommand):
+    help = "Measure group_send -> receive throughput and latency of the channel layers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help="Messages sent to the group.")
+        parser.add_argument('--members', type=int, default=10, help="Channels in the group.")
+        parser.add_argument('--layer', choices=[*LAYERS, 'all'], default='all')
+
+    def handle(self, *args, **options):
+        names = list(LAYERS) if options['layer'] == 'all' else [options['layer']]
+        for name in names:
+            elapsed, latencies = asyncio.run(self.run(LAYERS[name](), options['messages'], options['members']))
+            delivered = options['messages'] * options['members']
+            latencies.sort()
+            self.stdout.write(
+                f"{name:>8}: {delivered} deliveries in {elapsed:.2f}s "
+                f"({delivered / elapsed:,.0f}/s), latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms "
+                f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms"
+            )
+
+    async def run(self, layer, messages, members):
+        channels = [await layer.new_channel() for _ in range(members)]
+        for channel in channels:
+            await layer.group_add('benchmark', channel)
+        latencies = []
+        started = time.perf_counter()
+        for number in range(messages):
+            await layer.group_send('benchmark', {'type': 'benchmark.message', 'sent': time.perf_counter(), 'number': number})
+            for channel in channels:
+                message = await layer.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+        elapsed = time.perf_counter() - started
+        await layer.flush()
+        return elapsed, latencies
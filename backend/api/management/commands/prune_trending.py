@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import trending
+
+
+class Command(BaseCommand):
+    help = "Drop trending scores that have decayed below TRENDING['MIN_SCORE']."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Recompute every score from the post counters first.")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            scored = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Trending scores rebuilt for {scored} post(s)."))
+        pruned = trending.prune()
+        self.stdout.write(self.style.SUCCESS(f"{pruned} faded trending score(s) pruned."))
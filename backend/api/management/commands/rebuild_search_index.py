@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = "Recompute every search document and rebuild the search and user autocomplete indexes."
+
+    def handle(self, *args, **options):
+        for index in search.indexes.values():
+            index.rebuild()
+            self.stdout.write(f"{index.kind}: {search.backend_for(index.table)} backend")
+        search.users.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search indexes rebuilt."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import timeline
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill every user's home timeline and trim it to TIMELINE_MAX_LENGTH entries. "
+        "Run it with --trim-only periodically: posting does not trim timelines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trim-only', action='store_true', help="Only drop entries past the cap.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True).order_by('id')
+        if options['trim_only']:
+            trimmed = 0
+            user_ids = list(users.values_list('id', flat=True))
+            for start in range(0, len(user_ids), timeline.BATCH_SIZE):
+                trimmed += timeline.trim_many(user_ids[start:start + timeline.BATCH_SIZE])
+            self.stdout.write(self.style.SUCCESS(f"{trimmed} timeline entries trimmed."))
+            return
+        for user in users.iterator():
+            timeline.backfill(user)
+        self.stdout.write(self.style.SUCCESS(f"Timelines rebuilt for {users.count()} user(s)."))
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import Commentaire, Likes, Posts, SavedPost
+from api.signals import bump_post_versions
+
+COUNTED_ROWS = {
+    'likes_count': Likes,
+    'comments_count': Commentaire,
+    'saves_count': SavedPost,
+}
+
+
+def actual_count(model):
+    rows = (
+        model.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = "Recompute the like/comment/save counters on Posts and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drifted posts without fixing them.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        annotations = {f'actual_{field}': actual_count(model) for field, model in COUNTED_ROWS.items()}
+        drift = Q()
+        for field in COUNTED_ROWS:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+
+        drifted = (
+            Posts.objects.annotate(**annotations)
+            .filter(drift)
+            .only('id', 'user_id', *COUNTED_ROWS)
+            .order_by('id')
+        )
+
+        batch = []
+        repaired = 0
+        for post in drifted.iterator(chunk_size=options['batch_size']):
+            changes = []
+            for field in COUNTED_ROWS:
+                actual = getattr(post, f'actual_{field}')
+                if getattr(post, field) != actual:
+                    changes.append(f"{field} {getattr(post, field)} -> {actual}")
+                    setattr(post, field, actual)
+            self.stdout.write(f"Post {post.id}: {', '.join(changes)}")
+            batch.append(post)
+            if len(batch) >= options['batch_size']:
+                repaired += self.save_batch(batch, options['dry_run'])
+                batch = []
+        repaired += self.save_batch(batch, options['dry_run'])
+
+        verb = "would be repaired" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"{repaired} post(s) {verb}."))
+
+    def save_batch(self, batch, dry_run):
+        if batch and not dry_run:
+            # A new version changes the posts' ETags and cached responses
+            for post in batch:
+                post.version = F('version') + 1
+            with transaction.atomic():
+                Posts.objects.bulk_update(batch, [*COUNTED_ROWS, 'version'])
+            for post in batch:
+                bump_post_versions(post.id, post.user_id)
+        return len(batch)
@@ -2,12 +2,11 @@
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
-from django.conf import settings
-import jwt
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from urllib.parse import parse_qs
 
-User = get_user_model()
+from .authentication import authenticator, cached_user, load_user
 
 class JWTAuthMiddleware(BaseMiddleware):
     def __init__(self, inner):
@@ -20,30 +19,24 @@ class JWTAuthMiddleware(BaseMiddleware):
             query_params = parse_qs(query_string)
             token = query_params.get('token', [None])[0]
             
-            if token:
-                try:
-                    # Decode JWT token
-                    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-                    user_id = payload.get('user_id')
-                    
-                    if user_id:
-                        user = await self.get_user(user_id)
-                        scope['user'] = user if user else AnonymousUser()
-                    else:
-                        scope['user'] = AnonymousUser()
-                except:
-                    scope['user'] = AnonymousUser()
-            else:
-                scope['user'] = AnonymousUser()
+            scope['user'] = await self.get_user(token) if token else AnonymousUser()
         
         return await self.inner(scope, receive, send)
 
-    @database_sync_to_async
-    def get_user(self, user_id):
+    async def get_user(self, token):
+        """
+        The token's user, from the caches in api/authentication.py when
+        possible, so reconnects do not query the database.
+        """
         try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return None
+            validated_token = authenticator.get_validated_token(token)
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except (TokenError, InvalidToken, KeyError):
+            return AnonymousUser()
+        user = cached_user(user_id)
+        if user is None:
+            user = await database_sync_to_async(load_user)(user_id)
+        return user if user is not None and user.is_active else AnonymousUser()
 
 def JWTAuthMiddlewareStack(inner):
     return JWTAuthMiddleware(inner)
\ No newline at end of file
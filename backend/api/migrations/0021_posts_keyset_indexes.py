@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_remove_groupmessage_group_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['date_creation', 'id'], name='posts_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['user', 'date_creation', 'id'], name='posts_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['groupe', 'date_creation', 'id'], name='posts_groupe_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 11:47
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Posts = apps.get_model('api', 'Posts')
+    counted = {
+        'likes_count': apps.get_model('api', 'Likes'),
+        'comments_count': apps.get_model('api', 'Commentaire'),
+        'saves_count': apps.get_model('api', 'SavedPost'),
+    }
+    for field, model in counted.items():
+        rows = (
+            model.objects.filter(post=OuterRef('pk'))
+            .order_by()
+            .values('post')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        Posts.objects.update(**{field: Coalesce(Subquery(rows, output_field=IntegerField()), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_posts_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='saves_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
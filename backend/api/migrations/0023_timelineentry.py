@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_timelines(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    Posts = apps.get_model('api', 'Posts')
+    TimelineEntry = apps.get_model('api', 'TimelineEntry')
+    max_length = getattr(settings, 'TIMELINE_MAX_LENGTH', 500)
+    for user in User.objects.filter(is_active=True).iterator():
+        latest = (
+            Posts.objects.filter(
+                Q(groupe__isnull=True) | Q(groupe__users=user) | Q(groupe__admin=user) | Q(user=user)
+            )
+            .distinct()
+            .order_by('-date_creation', '-id')
+            .values_list('id', 'date_creation')[:max_length]
+        )
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user=user, post_id=post_id, date_creation=date_creation) for post_id, date_creation in latest],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_posts_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_creation', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.posts')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date_creation', 'post'], name='timeline_user_feed_idx')],
+                'unique_together': {('user', 'post')},
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupe',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-18 11:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_conditional_get_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='api.posts')),
+                ('rank_key', models.FloatField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_postscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commentaire',
+            name='date_creation',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='commentaire',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='api.commentaire'),
+        ),
+        migrations.AddIndex(
+            model_name='commentaire',
+            index=models.Index(fields=['post', 'date_creation', 'id'], name='comments_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentaire',
+            index=models.Index(fields=['parent', 'date_creation', 'id'], name='comments_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 5.2 on 2026-10-18 12:03
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import OperationalError, migrations, models
+
+BATCH_SIZE = 1000
+MAX_TERM_LENGTH = 64
+TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a au aux avec ce ces dans de des du elle en et il ils je la le les leur '
+    'ma mais me mes mon ne nous on ou par pas pour qu que qui sa se ses son '
+    'sur ta te tes ton tu un une vos votre vous'.split()
+)
+
+
+# The helpers below are copies of those in api/search.py as of this
+# migration, so later changes to that module cannot alter what it does.
+# Migrations 0029 and 0030 reuse them from here.
+
+def fold(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+def create_native_index(schema_editor, model):
+    table = model._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {table}_search_idx ON {table} (search_document)')
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {table}_fts USING fts5(document, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            pass
+
+
+def drop_native_index(schema_editor, model):
+    table = model._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(f'DROP INDEX {table}_search_idx ON {table}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+def populate_index(schema_editor, kind, model, term_model):
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    backend = getattr(settings, 'SEARCH', {}).get('BACKEND', 'auto')
+    if backend == 'auto':
+        if connection.vendor == 'mysql':
+            backend = 'fulltext'
+        elif connection.vendor == 'sqlite' and f'{table}_fts' in connection.introspection.table_names():
+            backend = 'fts5'
+        else:
+            backend = 'terms'
+    if backend == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}_fts')
+            cursor.execute(f'INSERT INTO {table}_fts (rowid, document) SELECT id, search_document FROM {table}')
+    elif backend == 'terms':
+        term_model.objects.filter(kind=kind).delete()
+        batch = []
+        for pk, document in model.objects.values_list('pk', 'search_document').iterator(chunk_size=BATCH_SIZE):
+            batch.extend(term_model(kind=kind, object_id=pk, term=term, weight=weight) for term, weight in Counter(tokenize(document)).items())
+            if len(batch) >= BATCH_SIZE:
+                term_model.objects.bulk_create(batch)
+                batch = []
+        term_model.objects.bulk_create(batch)
+
+
+def create_posts_index(apps, schema_editor):
+    Posts = apps.get_model('api', 'Posts')
+    create_native_index(schema_editor, Posts)
+    batch = []
+    for post in Posts.objects.select_related('user').only('contenu_texte', 'user__username').iterator(chunk_size=BATCH_SIZE):
+        post.search_document = fold(f'{post.contenu_texte} {post.user.username}')
+        batch.append(post)
+        if len(batch) >= BATCH_SIZE:
+            Posts.objects.bulk_update(batch, ['search_document'])
+            batch = []
+    Posts.objects.bulk_update(batch, ['search_document'])
+    populate_index(schema_editor, 'posts', Posts, apps.get_model('api', 'SearchTerm'))
+
+
+def drop_posts_index(apps, schema_editor):
+    drop_native_index(schema_editor, apps.get_model('api', 'Posts'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('object_id', models.PositiveIntegerField()),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term', 'object_id'], name='search_term_idx'), models.Index(fields=['kind', 'object_id'], name='search_object_idx')],
+            },
+        ),
+        migrations.RunPython(create_posts_index, drop_posts_index),
+    ]
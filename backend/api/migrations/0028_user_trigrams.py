@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-18 12:04
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+TOKEN_RE = re.compile(r'\w+')
+FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+# The helpers below are copies of those in api/search.py as of this
+# migration, so later changes to that module cannot alter what it does.
+
+def fold(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def trigrams(text):
+    grams = set()
+    for word in TOKEN_RE.findall(fold(text)):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def user_document(username, first_name, last_name, email):
+    return ' '.join([username or '', first_name or '', last_name or '', (email or '').split('@')[0]])
+
+
+def backfill_trigrams(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    UserTrigram = apps.get_model('api', 'UserTrigram')
+    batch = []
+    for pk, *values in User.objects.values_list('pk', *FIELDS).iterator(chunk_size=BATCH_SIZE):
+        batch.extend(UserTrigram(user_id=pk, trigram=gram) for gram in trigrams(user_document(*values)))
+        if len(batch) >= BATCH_SIZE:
+            UserTrigram.objects.bulk_create(batch)
+            batch = []
+    UserTrigram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('trigram', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_trigrams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 12:05
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# The search index helpers frozen in migration 0027
+search_index = import_module('api.migrations.0027_search_index')
+
+
+def create_groups_index(apps, schema_editor):
+    Groupe = apps.get_model('api', 'Groupe')
+    search_index.create_native_index(schema_editor, Groupe)
+    groups = list(Groupe.objects.only('nom', 'bio'))
+    for groupe in groups:
+        groupe.search_document = search_index.fold(f'{groupe.nom or ""} {groupe.bio or ""}')
+    Groupe.objects.bulk_update(groups, ['search_document'], batch_size=search_index.BATCH_SIZE)
+    search_index.populate_index(schema_editor, 'groups', Groupe, apps.get_model('api', 'SearchTerm'))
+
+
+def drop_groups_index(apps, schema_editor):
+    search_index.drop_native_index(schema_editor, apps.get_model('api', 'Groupe'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_user_trigrams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupe',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(create_groups_index, drop_groups_index),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-18 12:06
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# The search index helpers frozen in migration 0027
+search_index = import_module('api.migrations.0027_search_index')
+
+
+def create_resources_index(apps, schema_editor):
+    Ressources = apps.get_model('api', 'Ressources')
+    search_index.create_native_index(schema_editor, Ressources)
+    resources = list(Ressources.objects.only('title'))
+    for ressource in resources:
+        ressource.search_document = search_index.fold(ressource.title or '')
+    Ressources.objects.bulk_update(resources, ['search_document'], batch_size=search_index.BATCH_SIZE)
+    search_index.populate_index(schema_editor, 'resources', Ressources, apps.get_model('api', 'SearchTerm'))
+
+
+def drop_resources_index(apps, schema_editor):
+    search_index.drop_native_index(schema_editor, apps.get_model('api', 'Ressources'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_group_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ressources',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(create_resources_index, drop_resources_index),
+    ]
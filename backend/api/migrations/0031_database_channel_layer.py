@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_resource_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelGroupMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('channel', models.CharField(max_length=100)),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'unique_together': {('group', 'channel')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ChannelMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('message', models.TextField()),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['channel', 'id'], name='channel_message_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 12:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min
+
+
+def create_watermarks(apps, schema_editor):
+    """
+    Each participant's watermark is the message just before the first one
+    they have not read, or the last message when they have read everything.
+    """
+    Conversation = apps.get_model('api', 'Conversation')
+    ConversationParticipant = apps.get_model('api', 'ConversationParticipant')
+    Message = apps.get_model('api', 'Message')
+    participants = []
+    for conversation in Conversation.objects.only('initiator_id', 'receiver_id').iterator():
+        for user_id in {conversation.initiator_id, conversation.receiver_id}:
+            received = Message.objects.filter(conversation_id=conversation.pk).exclude(sender_id=user_id)
+            marks = received.aggregate(first_unread=Min('id', filter=models.Q(read=False)), last=Max('id'))
+            last_read_id = marks['first_unread'] - 1 if marks['first_unread'] else marks['last'] or 0
+            participants.append(ConversationParticipant(conversation_id=conversation.pk, user_id=user_id, last_read_id=last_read_id))
+    ConversationParticipant.objects.bulk_create(participants, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_database_channel_layer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_id', models.PositiveBigIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='api.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('conversation', 'user')},
+            },
+        ),
+        migrations.RunPython(create_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='read',
+        ),
+    ]
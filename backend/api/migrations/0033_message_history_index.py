@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='messages_history_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 12:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_inbox(apps, schema_editor):
+    ConversationParticipant = apps.get_model('api', 'ConversationParticipant')
+    Message = apps.get_model('api', 'Message')
+    participants = []
+    for participant in ConversationParticipant.objects.select_related('conversation').iterator():
+        messages = Message.objects.filter(conversation_id=participant.conversation_id)
+        last = messages.order_by('-id').only('id', 'timestamp').first()
+        participant.last_message = last
+        participant.last_activity = last.timestamp if last else participant.conversation.start_timestamp
+        participant.unread_count = (
+            messages.filter(id__gt=participant.last_read_id).exclude(sender_id=participant.user_id).count()
+        )
+        participants.append(participant)
+    ConversationParticipant.objects.bulk_update(
+        participants, ['last_message', 'last_activity', 'unread_count'], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', 'last_activity', 'id'], name='inbox_idx'),
+        ),
+        migrations.RunPython(fill_inbox, migrations.RunPython.noop),
+    ]
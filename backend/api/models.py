@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce, RowNumber
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
@@ -23,12 +24,26 @@ class User(AbstractUser):
     
     username = models.CharField(max_length=50,unique=True)
     email = models.EmailField(unique=True)
+    date_modification = models.DateTimeField(auto_now=True)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
     def __str__(self) -> str:
         return self.email
+
+
+# Columns behind the author card nested in posts, comments, messages, ...
+AUTHOR_FIELDS = ('id', 'username', 'profile_picture')
+
+
+def author_deferred(relation):
+    """defer() arguments that skip every User column the author card does not use."""
+    return [
+        f'{relation}__{field.name}' for field in User._meta.concrete_fields
+        if field.name not in AUTHOR_FIELDS
+    ]
+
     
 class VerificationToken(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -53,11 +68,25 @@ class Groupe(models.Model):
     profile_picture = models.ImageField(null=True,upload_to='groups/', blank=True)
 
     bio = models.CharField(max_length=500, null=True)
+    date_modification = models.DateTimeField(auto_now=True)
+    # Folded name and bio behind the search index (api/search.py)
+    search_document = models.TextField(default='', blank=True, editable=False)
+
     def delete(self, *args, **kwargs):
         self.users.clear()
         super().delete(*args, **kwargs)
 
 
+class PostsQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """
+        Load everything PostsSerializer reads in the same query: the author
+        row is joined in and the counts come from the denormalized columns,
+        so serializing a page costs no per-row queries.
+        """
+        return self.select_related('user').defer('search_document', *author_deferred('user'))
+
+
 class Posts(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date_creation = models.DateTimeField(default=timezone.now)
@@ -71,19 +100,144 @@ class Posts(models.Model):
         )
     groupe = models.ForeignKey(Groupe, on_delete=models.CASCADE, null=True)
 
+    # Denormalized counters, kept in step by the handlers in api/signals.py
+    # and repaired by `manage.py recount_post_counters`
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    saves_count = models.PositiveIntegerField(default=0)
+    # Bumped with every edit and every counter change; feeds the post's ETag
+    version = models.PositiveIntegerField(default=0)
+    # Folded text behind the search index (api/search.py)
+    search_document = models.TextField(default='', blank=True, editable=False)
+
+    objects = PostsQuerySet.as_manager()
+
+    class Meta:
+        # Keyset pagination walks these (date_creation, id) orderings
+        indexes = [
+            models.Index(fields=['date_creation', 'id'], name='posts_feed_idx'),
+            models.Index(fields=['user', 'date_creation', 'id'], name='posts_user_feed_idx'),
+            models.Index(fields=['groupe', 'date_creation', 'id'], name='posts_groupe_feed_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version = models.F('version') + 1
+        super().save(*args, **kwargs)
+        if isinstance(self.version, models.expressions.Combinable):
+            self.refresh_from_db(fields=['version'])
 
     def num_comments(self):
-        return self.comments.count()
+        return self.comments_count
 
     def num_likes(self):
-        return self.likes.count()
+        return self.likes_count
     def num_saves(self):
-        return self.saved_by.count()
+        return self.saves_count
+
+class TimelineEntry(models.Model):
+    """
+    One row per post in a user's home feed, written when the post is created
+    (see api/timeline.py). date_creation is copied from the post so a feed
+    page is a range scan on (user, date_creation, post) without a join.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Posts, on_delete=models.CASCADE, related_name='timeline_entries')
+    date_creation = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', 'date_creation', 'post'], name='timeline_user_feed_idx'),
+        ]
+
+
+class PostScore(models.Model):
+    """
+    Time-decayed engagement of a public post (see api/trending.py).
+    rank_key is the log of the score scaled to a fixed epoch, so it only
+    changes when an event arrives, and ordering by it ranks posts by their
+    current score.
+    """
+    post = models.OneToOneField(Posts, on_delete=models.CASCADE, primary_key=True, related_name='trending_score')
+    rank_key = models.FloatField(db_index=True)
+
+
+class SearchTerm(models.Model):
+    """
+    Portable inverted index row: `term` occurs `weight` times in the search
+    document of object `object_id` of `kind` (see api/search.py).
+    """
+    kind = models.CharField(max_length=16)
+    object_id = models.PositiveIntegerField()
+    term = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term', 'object_id'], name='search_term_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_object_idx'),
+        ]
+
+
+class UserTrigram(models.Model):
+    """
+    One trigram of a user's names (see UserAutocomplete in api/search.py);
+    autocomplete counts the trigrams a query shares with each user.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trigrams')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = ('trigram', 'user')
+
+
+class CommentaireQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Comments with their author card and number of direct replies, in one query"""
+        replies = (
+            Commentaire.objects.filter(parent=models.OuterRef('pk'))
+            .order_by()
+            .values('parent')
+            .annotate(total=models.Count('id'))
+            .values('total')
+        )
+        return (
+            self.select_related('user')
+            .defer(*author_deferred('user'))
+            .annotate(reply_count=Coalesce(models.Subquery(replies), 0))
+        )
+
+    def first_per_post(self, post_ids, count):
+        """The first `count` top-level comments of each post, with one windowed query"""
+        return (
+            self.for_serializer()
+            .filter(post_id__in=post_ids, parent__isnull=True)
+            .annotate(position=models.Window(
+                RowNumber(),
+                partition_by=models.F('post_id'),
+                order_by=[models.F('date_creation').asc(), models.F('id').asc()],
+            ))
+            .filter(position__lte=count)
+            .order_by('post_id', 'position')
+        )
+
 
 class Commentaire(models.Model):
     post = models.ForeignKey(Posts, on_delete=models.CASCADE, related_name='comments', null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE,null=True)
     content = models.TextField()
+    date_creation = models.DateTimeField(default=timezone.now)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='replies', null=True, blank=True)
+
+    objects = CommentaireQuerySet.as_manager()
+
+    class Meta:
+        # Comment pages are walked oldest first on these orderings
+        indexes = [
+            models.Index(fields=['post', 'date_creation', 'id'], name='comments_post_idx'),
+            models.Index(fields=['parent', 'date_creation', 'id'], name='comments_thread_idx'),
+        ]
 
 class Likes(models.Model):
     post = models.ForeignKey(Posts, on_delete=models.CASCADE, related_name='likes', null=True)
@@ -109,6 +263,8 @@ class Ressources(models.Model):
     date_creation = models.DateTimeField(default=timezone.now)
     title = models.CharField(max_length=100,null=True)
     media = models.FileField(null=True,upload_to='ressources/', blank=True)
+    # Folded title behind the search index (api/search.py)
+    search_document = models.TextField(default='', blank=True, editable=False)
 
 
 
@@ -130,13 +286,39 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    read = models.BooleanField(default=False)
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:20]}"
     
     class Meta:
         ordering = ['timestamp']
+        # History pages are range scans on (conversation, id) (see MessagePagination)
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='messages_history_idx'),
+        ]
+
+
+class ConversationParticipant(models.Model):
+    """
+    A user's side of a conversation, which doubles as their inbox row.
+    last_read_id is the user's read watermark: every message of the
+    conversation up to that id has been read (see api/chat.py). The read flag
+    of serialized messages is derived from it. last_message, last_activity
+    and unread_count are kept up to date as messages are written and read,
+    so the inbox is a single range scan on (user, last_activity, id).
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    last_read_id = models.PositiveBigIntegerField(default=0)
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity = models.DateTimeField(default=timezone.now)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('conversation', 'user')
+        indexes = [
+            models.Index(fields=['user', 'last_activity', 'id'], name='inbox_idx'),
+        ]
 
 class Reports(models.Model):
     user_reported = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -148,4 +330,26 @@ class Reports(models.Model):
         ("inappropriate_content","Contenu inapproprié"),
         ("other","Autre")
     ]
-    cause = models.CharField(max_length=255, choices=choices, default="false_news")
\ No newline at end of file
+    cause = models.CharField(max_length=255, choices=choices, default="false_news")
+
+
+class ChannelMessage(models.Model):
+    """A message queued on a channel of the database channel layer (api/layers.py)"""
+    channel = models.CharField(max_length=100)
+    message = models.TextField()
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['channel', 'id'], name='channel_message_idx'),
+        ]
+
+
+class ChannelGroupMembership(models.Model):
+    """A channel's membership of a group in the database channel layer"""
+    group = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('group', 'channel')
@@ -0,0 +1,224 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering, newest first by default.
+
+    The next page is selected with a WHERE on the last row's keys instead of
+    an OFFSET, so pages stay stable while new rows are inserted and the cost
+    of a page does not depend on how deep the client has scrolled.
+
+    The paginator only kicks in when the client sends `limit` or `cursor`;
+    otherwise `paginate_queryset` returns None and the view keeps its old
+    plain-list response.
+    """
+    ordering = ('-date_creation', '-id')
+    default_limit = 20
+    max_limit = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if 'limit' not in params and 'cursor' not in params:
+            return None
+
+        self.limit = self.get_limit(params)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = params.get('cursor')
+        if cursor:
+            values = self.parse_values(queryset.model, self.decode_cursor(cursor))
+            queryset = queryset.filter(self.cursor_filter(values))
+
+        page = list(queryset[:self.limit + 1])
+        has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.next_cursor = self.encode_cursor(page[-1]) if has_next else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_cursor,
+            'results': data,
+        })
+
+    def get_limit(self, params):
+        try:
+            limit = int(params.get('limit', self.default_limit))
+        except (TypeError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def get_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def cursor_filter(self, values):
+        """
+        Build `(a, b) < (va, vb)` as `a < va OR (a = va AND b < vb)`, which
+        every backend can answer with a range scan on the (a, b) index.
+        """
+        condition = Q()
+        equal = {}
+        for field, ordering, value in zip(self.get_fields(), self.ordering, values):
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, obj):
+        values = []
+        for field in self.get_fields():
+            value = getattr(obj, field)
+            # isoformat keeps microseconds, which DjangoJSONEncoder would drop
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return self.encode_values(values)
+
+    def encode_values(self, values):
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def parse_values(self, model, values):
+        """
+        Convert decoded cursor values to the types of the ordering fields
+        (datetimes from their isoformat, ids from ints), so a tampered cursor
+        is rejected here rather than failing inside the query.
+        """
+        parsed = []
+        for field_name, value in zip(self.get_fields(), values):
+            field = model._meta.get_field(field_name)
+            try:
+                value = None if value is None else field.to_python(value)
+            except ValidationError:
+                value = None
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            parsed.append(value)
+        return parsed
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+
+class TimelinePagination(KeysetPagination):
+    """Pages through TimelineEntry rows on the (user, date_creation, post) index."""
+    ordering = ('-date_creation', '-post_id')
+
+
+class CommentPagination(KeysetPagination):
+    """Oldest first, on the (post, date_creation, id) and (parent, ...) indexes."""
+    ordering = ('date_creation', 'id')
+
+
+class InboxPagination(KeysetPagination):
+    """Conversations by recent activity, on the (user, last_activity, id) inbox index."""
+    ordering = ('-last_activity', '-id')
+
+
+class MessagePagination(KeysetPagination):
+    """
+    Message history on the (conversation, id) index, oldest first within a
+    page. Without an anchor a page holds the latest messages; `before_id`
+    and `after_id` page backwards and forwards from a message and
+    `around_id` returns the page centred on one, for jumping to it.
+
+    `before` and `after` in the response are the ids to pass as before_id
+    and after_id for the neighbouring pages, or null when there are none.
+    Kicks in when the client sends `limit` or one of the anchors.
+    """
+    ordering = ('id',)
+    default_limit = 50
+    anchors = ('before_id', 'after_id', 'around_id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        anchors = [anchor for anchor in self.anchors if anchor in params]
+        if 'limit' not in params and not anchors:
+            return None
+
+        self.limit = self.get_limit(params)
+        queryset = queryset.order_by()
+        anchor = anchors[0] if anchors else None
+        if anchor is not None:
+            try:
+                anchor_id = int(params[anchor])
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        if anchor is None:
+            page, more_before = self.older(queryset, None, self.limit)
+            more_after = False
+        elif anchor == 'before_id':
+            page, more_before = self.older(queryset, anchor_id, self.limit)
+            more_after = bool(page)
+        elif anchor == 'after_id':
+            page, more_after = self.newer(queryset.filter(id__gt=anchor_id), self.limit)
+            more_before = bool(page)
+        else:
+            before, more_before = self.older(queryset, anchor_id, self.limit // 2)
+            after, more_after = self.newer(queryset.filter(id__gte=anchor_id), self.limit - len(before))
+            page = before + after
+
+        self.before = page[0].id if page and more_before else None
+        self.after = page[-1].id if page and more_after else None
+        return page
+
+    def older(self, queryset, below, count):
+        """The `count` messages just below id `below`, ascending, and whether there are more"""
+        if below is not None:
+            queryset = queryset.filter(id__lt=below)
+        rows = list(queryset.order_by('-id')[:count + 1])
+        return rows[:count][::-1], len(rows) > count
+
+    def newer(self, queryset, count):
+        rows = list(queryset.order_by('id')[:count + 1])
+        return rows[:count], len(rows) > count
+
+    def get_paginated_response(self, data):
+        return Response({
+            'before': self.before,
+            'after': self.after,
+            'results': data,
+        })
+
+
+class RankedPagination(KeysetPagination):
+    """
+    Pages through relevance-ranked ids. A ranking has no unique sortable key
+    to seek on, so the cursor carries the offset instead; rankings break ties
+    by id, so pages neither overlap nor skip rows while the index is unchanged.
+    """
+    ordering = ('offset',)
+    default_limit = 10
+
+    def paginate_ranked(self, search, request):
+        """Call `search(offset, limit)` for the requested page, or return None."""
+        params = request.query_params
+        if 'limit' not in params and 'cursor' not in params:
+            return None
+
+        self.limit = self.get_limit(params)
+        offset = 0
+        cursor = params.get('cursor')
+        if cursor:
+            offset = self.decode_cursor(cursor)[0]
+            if not isinstance(offset, int) or offset < 0:
+                raise NotFound(self.invalid_cursor_message)
+
+        ids = search(offset, self.limit + 1)
+        self.next_cursor = self.encode_values([offset + self.limit]) if len(ids) > self.limit else None
+        return ids[:self.limit]
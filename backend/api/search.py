@@ -0,0 +1,486 @@
+"""
+Full-text search.
+
+Each searchable model (posts, groups, resources) keeps a `search_document` column holding its text
+accent-folded and lower-cased (see `fold`), so "Économie" and "economie"
+index the same way. What indexes that column depends on the database:
+
+- MySQL: a FULLTEXT index on the column, queried in boolean mode;
+- SQLite: an FTS5 table `<table>_fts` whose rowid is the object's pk (for
+  local runs; used when the SQLite build has FTS5);
+- anything else: SearchTerm rows, an inverted index maintained in Python
+  that any backend answers with a range scan on (kind, term).
+
+The signal handlers in api/signals.py keep documents and indexes in step
+with writes, and `manage.py rebuild_search_index` rebuilds them all (run it
+after changing SEARCH['BACKEND']). Results are ids ranked by relevance then
+newest first, so a given query always pages through the same order.
+"""
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import Case, Count, IntegerField, Max, Q, Sum, When
+from django.db.models.expressions import RawSQL
+
+from .cache import LRUCache
+from .models import Groupe, Posts, Ressources, SearchTerm, User, UserTrigram
+
+logger = logging.getLogger(__name__)
+
+OPTIONS = getattr(settings, 'SEARCH', {})
+BACKEND = OPTIONS.get('BACKEND', 'auto')
+SECTION_TIMEOUT = OPTIONS.get('SECTION_TIMEOUT', 0.5)
+WORKERS = OPTIONS.get('WORKERS', 4)
+CACHE_ENTRIES = OPTIONS.get('CACHE_ENTRIES', 1000)
+CACHE_TIMEOUT = OPTIONS.get('CACHE_TIMEOUT', 60)
+# MySQL's innodb_ft_min_token_size: shorter words are not in a FULLTEXT index
+FULLTEXT_MIN_TOKEN_SIZE = OPTIONS.get('FULLTEXT_MIN_TOKEN_SIZE', 3)
+MAX_TERMS = 8
+MAX_TERM_LENGTH = 64
+BATCH_SIZE = 1000
+
+TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a au aux avec ce ces dans de des du elle en et il ils je la le les leur '
+    'ma mais me mes mon ne nous on ou par pas pour qu que qui sa se ses son '
+    'sur ta te tes ton tu un une vos votre vous'.split()
+)
+
+
+def fold(text):
+    """Lower-case `text` and strip its accents."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+def parse(query):
+    """
+    The distinct terms of `query`, and whether the last one is a prefix
+    (it is while the user is still typing it, i.e. no trailing space).
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+    return terms, bool(terms) and not query[-1:].isspace()
+
+
+class SearchCache:
+    """
+    Id lists of recent searches, keyed by the normalized query (index kind,
+    folded terms, page), with LRU eviction and a TTL. Each entry is filed
+    under its terms, and a write drops only the entries whose terms occur in
+    the old or new text of what changed: a new post about "stage" evicts the
+    cached "stage" searches and nothing else. Entries live in one process;
+    other workers see a write once their copy expires.
+    """
+    def __init__(self, max_entries=1000, timeout=60):
+        self.entries = LRUCache(max_entries, timeout, on_evict=self.forget)
+        self.exact = defaultdict(set)  # (kind, term) -> keys
+        self.prefixes = defaultdict(set)  # (kind, prefix) -> keys
+        self.filed = {}  # key -> where it is filed
+        self.invalidations = 0
+        # Reentrant: LRUCache calls forget() back while we hold the lock
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, ids, terms, prefix=None):
+        kind = key[0]
+        with self.lock:
+            self.forget(key)
+            filed = [(self.exact, (kind, term)) for term in terms]
+            if prefix:
+                filed.append((self.prefixes, (kind, prefix)))
+            for keys_by_term, name in filed:
+                keys_by_term[name].add(key)
+            self.filed[key] = filed
+            self.entries.set(key, ids)
+
+    def forget(self, key):
+        for keys_by_term, name in self.filed.pop(key, ()):
+            keys = keys_by_term.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del keys_by_term[name]
+
+    def invalidate(self, kind, terms=None):
+        """Drop the entries of `kind` a text with `terms` could match; all of them if terms is None."""
+        with self.lock:
+            if terms is None:
+                keys = {key for key in self.filed if key[0] == kind}
+            else:
+                keys = set()
+                for term in terms:
+                    keys |= self.exact.get((kind, term), set())
+                    for end in range(1, len(term) + 1):
+                        keys |= self.prefixes.get((kind, term[:end]), set())
+            for key in keys:
+                self.entries.delete(key)
+                self.forget(key)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.exact.clear()
+            self.prefixes.clear()
+            self.filed.clear()
+            self.invalidations = 0
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.entries.hits, self.entries.misses
+            return {
+                'entries': len(self.entries),
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+                'invalidations': self.invalidations,
+            }
+
+
+search_cache = SearchCache(CACHE_ENTRIES, CACHE_TIMEOUT)
+
+
+def document_terms(*documents):
+    """Index terms of these documents, or None if one of them is unknown."""
+    if any(document is None for document in documents):
+        return None
+    return {term for document in documents for term in tokenize(document)}
+
+
+# (database name, table) -> backend, so the FTS5 table is looked up once
+_backends = {}
+
+
+def backend_for(table):
+    if BACKEND != 'auto':
+        return BACKEND
+    key = (connection.settings_dict['NAME'], table)
+    if key not in _backends:
+        if connection.vendor == 'mysql':
+            _backends[key] = 'fulltext'
+        elif connection.vendor == 'sqlite' and f'{table}_fts' in connection.introspection.table_names():
+            _backends[key] = 'fts5'
+        else:
+            _backends[key] = 'terms'
+    return _backends[key]
+
+
+def create_native_index(schema_editor, model):
+    """Migration helper: add the database's own index over `search_document`."""
+    table = model._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {table}_search_idx ON {table} (search_document)')
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {table}_fts USING fts5(document, tokenize='unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # No FTS5 in this SQLite build; searches fall back to SearchTerm rows
+            pass
+
+
+def drop_native_index(schema_editor, model):
+    table = model._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(f'DROP INDEX {table}_search_idx ON {table}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+def populate_index(kind, model, term_model):
+    """Index every object from its stored search_document."""
+    table = model._meta.db_table
+    backend = backend_for(table)
+    if backend == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table}_fts')
+            cursor.execute(f'INSERT INTO {table}_fts (rowid, document) SELECT id, search_document FROM {table}')
+    elif backend == 'terms':
+        term_model.objects.filter(kind=kind).delete()
+        batch = []
+        for pk, document in model.objects.values_list('pk', 'search_document').iterator(chunk_size=BATCH_SIZE):
+            batch.extend(term_model(kind=kind, object_id=pk, term=term, weight=weight) for term, weight in Counter(tokenize(document)).items())
+            if len(batch) >= BATCH_SIZE:
+                term_model.objects.bulk_create(batch)
+                batch = []
+        term_model.objects.bulk_create(batch)
+
+
+def fulltext_expression(terms, prefix):
+    """
+    A boolean-mode MATCH expression requiring every term. Whole words shorter
+    than FULLTEXT_MIN_TOKEN_SIZE are left out: they are never indexed, so
+    requiring one would match nothing. A prefix is kept whatever its length.
+    """
+    required = [
+        f'+{term}*' if prefix and i == len(terms) - 1 else f'+{term}'
+        for i, term in enumerate(terms)
+        if len(term) >= FULLTEXT_MIN_TOKEN_SIZE or (prefix and i == len(terms) - 1)
+    ]
+    return ' '.join(required)
+
+
+class FullTextIndex:
+    """
+    The search index of one model. `document` returns the text to index
+    for an instance, reading only the relations listed in `related`.
+    """
+    def __init__(self, kind, model, document, related=()):
+        self.kind = kind
+        self.model = model
+        self.document = document
+        self.related = related
+        self.table = model._meta.db_table
+
+    def prepare(self, instance):
+        """Fill in `instance.search_document` before it is saved."""
+        # The text being replaced, for search_cache; None when it was not loaded
+        instance._previous_document = '' if instance._state.adding else instance.__dict__.get('search_document')
+        instance.search_document = fold(self.document(instance))
+
+    def sync(self, pk, document, previous=None):
+        """Write the external index entries of a saved object that used to read `previous`."""
+        search_cache.invalidate(self.kind, document_terms(document, previous))
+        backend = backend_for(self.table)
+        if backend == 'fts5':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {self.table}_fts WHERE rowid = %s', [pk])
+                cursor.execute(f'INSERT INTO {self.table}_fts (rowid, document) VALUES (%s, %s)', [pk, document])
+        elif backend == 'terms':
+            SearchTerm.objects.filter(kind=self.kind, object_id=pk).delete()
+            SearchTerm.objects.bulk_create([
+                SearchTerm(kind=self.kind, object_id=pk, term=term, weight=weight)
+                for term, weight in Counter(tokenize(document)).items()
+            ])
+
+    def remove(self, pk, document=None):
+        search_cache.invalidate(self.kind, document_terms(document))
+        backend = backend_for(self.table)
+        if backend == 'fts5':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {self.table}_fts WHERE rowid = %s', [pk])
+        elif backend == 'terms':
+            SearchTerm.objects.filter(kind=self.kind, object_id=pk).delete()
+
+    def reindex(self, queryset):
+        """Recompute the documents of `queryset` and index them again."""
+        for instance in queryset.iterator(chunk_size=BATCH_SIZE):
+            self.prepare(instance)
+            self.model.objects.filter(pk=instance.pk).update(search_document=instance.search_document)
+            self.sync(instance.pk, instance.search_document)
+        search_cache.invalidate(self.kind)
+
+    def rebuild(self):
+        batch = []
+        for instance in self.model.objects.select_related(*self.related).iterator(chunk_size=BATCH_SIZE):
+            self.prepare(instance)
+            batch.append(instance)
+            if len(batch) >= BATCH_SIZE:
+                self.model.objects.bulk_update(batch, ['search_document'])
+                batch = []
+        self.model.objects.bulk_update(batch, ['search_document'])
+        populate_index(self.kind, self.model, SearchTerm)
+        search_cache.invalidate(self.kind)
+
+    def search(self, query, offset=0, limit=10):
+        """Ids of the objects matching every term of `query`, best match first."""
+        terms, prefix = parse(query)
+        if not terms:
+            return []
+        key = (self.kind, tuple(terms), prefix, offset, limit)
+        ids = search_cache.get(key)
+        if ids is None:
+            search = getattr(self, f'search_{backend_for(self.table)}')
+            ids = list(search(terms, prefix, offset, limit))
+            if prefix:
+                search_cache.set(key, ids, terms[:-1], prefix=terms[-1])
+            else:
+                search_cache.set(key, ids, terms)
+        return list(ids)
+
+    def search_fulltext(self, terms, prefix, offset, limit):
+        expression = fulltext_expression(terms, prefix)
+        if not expression:
+            return []
+        return (
+            self.model.objects.annotate(rank=RawSQL('MATCH (search_document) AGAINST (%s IN BOOLEAN MODE)', [expression]))
+            .filter(rank__gt=0)
+            .order_by('-rank', '-pk')
+            .values_list('pk', flat=True)[offset:offset + limit]
+        )
+
+    def search_fts5(self, terms, prefix, offset, limit):
+        expression = ' '.join(f'"{term}"' for term in terms) + ('*' if prefix else '')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table}_fts WHERE {self.table}_fts MATCH %s '
+                f'ORDER BY bm25({self.table}_fts), rowid DESC LIMIT %s OFFSET %s',
+                [expression, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_terms(self, terms, prefix, offset, limit):
+        conditions = [Q(term=term) for term in terms]
+        if prefix:
+            conditions[-1] = Q(term__startswith=terms[-1])
+        matches = Q()
+        for condition in conditions:
+            matches |= condition
+        # One point per query term the object has, so only full matches are kept
+        matched = sum(Max(Case(When(condition, then=1), default=0, output_field=IntegerField())) for condition in conditions)
+        return (
+            SearchTerm.objects.filter(matches, kind=self.kind)
+            .values('object_id')
+            .annotate(matched=matched, score=Sum('weight'))
+            .filter(matched=len(conditions))
+            .order_by('-score', '-object_id')
+            .values_list('object_id', flat=True)[offset:offset + limit]
+        )
+
+
+posts = FullTextIndex('posts', Posts, lambda post: f'{post.contenu_texte} {post.user.username}', related=('user',))
+groups = FullTextIndex('groups', Groupe, lambda groupe: f'{groupe.nom or ""} {groupe.bio or ""}')
+resources = FullTextIndex('resources', Ressources, lambda ressource: ressource.title or '')
+
+# Model -> its full-text index, for the signal handlers and rebuild_search_index
+indexes = {index.model: index for index in (posts, groups, resources)}
+
+
+def trigrams(text, prefix=False):
+    """
+    Trigrams of each folded word of `text`, padded with two leading spaces
+    and one trailing space so word starts and ends count. A `prefix` gets no
+    trailing space: it matches the beginning of longer words.
+    """
+    grams = set()
+    for word in TOKEN_RE.findall(fold(text)):
+        padded = f'  {word}' + ('' if prefix else ' ')
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def user_document(username, first_name, last_name, email):
+    return ' '.join([username or '', first_name or '', last_name or '', (email or '').split('@')[0]])
+
+
+class UserAutocomplete:
+    """
+    Typo-tolerant autocomplete over usernames, first and last names and the
+    local part of emails. A user matches when they share at least
+    MIN_SIMILARITY of the query's trigrams, so "mohcnie" still finds
+    "mohcine"; the most shared trigrams come first.
+    """
+    fields = ('username', 'first_name', 'last_name', 'email')
+    MIN_SIMILARITY = 0.5
+
+    def sync(self, user, previous=None):
+        """Rewrite the trigrams of `user`, whose indexed fields used to hold `previous` (a dict)."""
+        grams = trigrams(user_document(*(getattr(user, field) for field in self.fields)))
+        UserTrigram.objects.filter(user=user).delete()
+        UserTrigram.objects.bulk_create([UserTrigram(user=user, trigram=gram) for gram in grams])
+        # A cached search can only list users sharing one of its trigrams
+        if previous is None or None in previous.values():
+            search_cache.invalidate('users')
+        else:
+            search_cache.invalidate('users', grams | trigrams(user_document(*(previous[field] for field in self.fields))))
+
+    def rebuild(self):
+        UserTrigram.objects.all().delete()
+        populate_trigrams(User, UserTrigram, self.fields)
+        search_cache.invalidate('users')
+
+    def search(self, query, limit=10):
+        """Ids of the best matching users."""
+        grams = trigrams(query, prefix=True)
+        if not grams:
+            return []
+        key = ('users', tuple(sorted(grams)), limit)
+        ids = search_cache.get(key)
+        if ids is None:
+            threshold = max(1, round(len(grams) * self.MIN_SIMILARITY))
+            ids = list(
+                UserTrigram.objects.filter(trigram__in=grams)
+                .values('user_id')
+                .annotate(shared=Count('id'))
+                .filter(shared__gte=threshold)
+                .order_by('-shared', 'user_id')
+                .values_list('user_id', flat=True)[:limit]
+            )
+            search_cache.set(key, ids, grams)
+        return list(ids)
+
+
+def populate_trigrams(user_model, trigram_model, fields=UserAutocomplete.fields):
+    """Index every user."""
+    batch = []
+    for pk, *values in user_model.objects.values_list('pk', *fields).iterator(chunk_size=BATCH_SIZE):
+        batch.extend(trigram_model(user_id=pk, trigram=gram) for gram in trigrams(user_document(*values)))
+        if len(batch) >= BATCH_SIZE:
+            trigram_model.objects.bulk_create(batch)
+            batch = []
+    trigram_model.objects.bulk_create(batch)
+
+
+users = UserAutocomplete()
+
+
+# Runs the sections of /api/search/ side by side; None runs them inline
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='search') if WORKERS else None
+
+
+def in_worker(task):
+    def run():
+        try:
+            return task()
+        finally:
+            # Worker threads hold their own connections; honour CONN_MAX_AGE
+            close_old_connections()
+    return run
+
+
+def gather(tasks, timeout=SECTION_TIMEOUT):
+    """
+    Run each of `tasks` ({name: callable}) and collect {name: (status,
+    result)}, status being 'ok', 'timeout' or 'error'. Every task gets the
+    same `timeout` seconds, counted together, so one slow source cannot hold
+    up the others; a late task keeps running but its result is dropped.
+    """
+    if executor is None:
+        futures = {}
+        for name, task in tasks.items():
+            future = futures[name] = Future()
+            try:
+                future.set_result(task())
+            except Exception as exc:
+                future.set_exception(exc)
+    else:
+        futures = {name: executor.submit(in_worker(task)) for name, task in tasks.items()}
+        wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[name] = ('timeout', None)
+        elif future.exception() is not None:
+            logger.error('Search section %s failed', name, exc_info=future.exception())
+            results[name] = ('error', None)
+        else:
+            results[name] = ('ok', future.result())
+    return results
@@ -1,4 +1,6 @@
+from django.db import models
 from rest_framework import serializers
+from . import chat
 from .models import User, Token,Posts, Commentaire, Likes,SavedPost,Ressources,Groupe,Message,Conversation,Reports
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
@@ -8,6 +10,70 @@ from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 User = get_user_model()
 
 
+def is_row(serializer):
+    """True for the top-level object or the items of a top-level list."""
+    parent = serializer.parent
+    return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+
+class SparseFieldsetMixin:
+    """
+    Keep only the fields named in context['fields'] (parsed from `?fields=`)
+    on top-level rows; nested serializers are left whole.
+    """
+    def requested_fields(self):
+        return self.context.get('fields') if is_row(self) else None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_fields()
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    def wants_field(self, name):
+        requested = self.requested_fields()
+        return not requested or name in requested
+
+
+class AuthorSerializer(serializers.Serializer):
+    """Read-only author card nested in posts, comments, messages, resources and groups"""
+    id = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(read_only=True)
+    profile_picture = serializers.ImageField(read_only=True)
+
+
+class NormalizedAuthorMixin:
+    """
+    With context['users'] set to a dict, rows carry `<author_field>_id`
+    instead of a nested author card, and each distinct author is collected
+    into that dict once so the view can send them as a side table.
+    """
+    author_field = 'user'
+
+    def normalizes_users(self):
+        return is_row(self) and self.context.get('users') is not None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.normalizes_users() and self.author_field in fields:
+            del fields[self.author_field]
+            fields[f'{self.author_field}_id'] = serializers.IntegerField(read_only=True)
+        return fields
+
+    def to_representation(self, instance):
+        if self.normalizes_users():
+            author = getattr(instance, self.author_field)
+            if author is not None:
+                self.context['users'].setdefault(author.pk, author)
+        return super().to_representation(instance)
+
+
+def users_table(context):
+    """The side table for authors collected by NormalizedAuthorMixin, keyed by id."""
+    return {str(pk): AuthorSerializer(user, context=context).data for pk, user in context['users'].items()}
+
+
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     
@@ -65,39 +131,94 @@ class TokenSerializer(serializers.ModelSerializer):
         model = Token
         fields = ['id', 'token', 'created_at', 'expires_at', 'user_id', 'is_used']
 
-class CommentsSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+class CommentsSerializer(NormalizedAuthorMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    user = AuthorSerializer(read_only=True)
+    reply_count = serializers.SerializerMethodField()
     class Meta:
         model = Commentaire
-        fields = ['id','user', 'content','post']
+        fields = ['id','user', 'content','post', 'parent', 'date_creation', 'reply_count']
+        read_only_fields = ['parent', 'date_creation']
+
+    def get_reply_count(self, obj):
+        # Annotated by Commentaire.objects.for_serializer(); single comments fall back to a query
+        if hasattr(obj, 'reply_count'):
+            return obj.reply_count
+        return obj.replies.count()
 
 class LikesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Likes
         fields = ['user','post']
 
+
+class PostsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.load_viewer_state(posts)
+        return super().to_representation(posts)
+
         
-class PostsSerializer(serializers.ModelSerializer):
-    num_comments = serializers.SerializerMethodField()
-    num_likes = serializers.SerializerMethodField()
+class PostsSerializer(NormalizedAuthorMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Pass `viewer` (the request user) in the context to get `user_has_liked`
+    and `user_has_saved`. Lists load both flags for the whole page with one
+    IN (...) query each.
+    """
+    num_comments = serializers.IntegerField(source='comments_count', read_only=True)
+    num_likes = serializers.IntegerField(source='likes_count', read_only=True)
     media = serializers.FileField(required=False, allow_null=True)
-    save_count = serializers.SerializerMethodField()
+    save_count = serializers.IntegerField(source='saves_count', read_only=True)
 
-    user = UserSerializer(read_only=True) 
+    user = AuthorSerializer(read_only=True)
 
     class Meta:
         model = Posts
         fields = ['id', 'user', 'date_creation', 'date_modification','groupe', 'contenu_texte', 'media', 'num_comments', 'num_likes','save_count']
         read_only_fields = ['id', 'date_creation', 'date_modification', 'user']
+        list_serializer_class = PostsListSerializer
 
-    def get_num_comments(self, obj):
-        return obj.comments.count()
+    def get_viewer(self):
+        viewer = self.context.get('viewer')
+        if viewer is None or not viewer.is_authenticated:
+            return None
+        if not (self.wants_field('user_has_liked') or self.wants_field('user_has_saved')):
+            return None
+        return viewer
+
+    def load_viewer_state(self, posts):
+        viewer = self.get_viewer()
+        post_ids = [post.pk for post in posts]
+        if viewer is None or not post_ids:
+            return
+        state = self.context.setdefault('viewer_state', {'loaded': set(), 'liked': set(), 'saved': set()})
+        state['loaded'].update(post_ids)
+        state['liked'].update(
+            Likes.objects.filter(user=viewer, post_id__in=post_ids).values_list('post_id', flat=True)
+        )
+        state['saved'].update(
+            SavedPost.objects.filter(user=viewer, post_id__in=post_ids).order_by().values_list('post_id', flat=True)
+        )
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.get_viewer() is not None:
+            state = self.context.get('viewer_state')
+            if state is None or instance.pk not in state['loaded']:
+                self.load_viewer_state([instance])
+                state = self.context['viewer_state']
+            if self.wants_field('user_has_liked'):
+                data['user_has_liked'] = instance.pk in state['liked']
+            if self.wants_field('user_has_saved'):
+                data['user_has_saved'] = instance.pk in state['saved']
+        return data
+
+
+class SavedPostListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        saved_posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.fields['post'].load_viewer_state([saved.post for saved in saved_posts])
+        return super().to_representation(saved_posts)
 
-    def get_num_likes(self, obj):
-        return obj.likes.count()
-    
-    def get_save_count(self, obj):
-        return obj.saved_by.count()
     
 class SavedPostSerializer(serializers.ModelSerializer):
     post = PostsSerializer(read_only=True)
@@ -106,30 +227,49 @@ class SavedPostSerializer(serializers.ModelSerializer):
         model = SavedPost
         fields = ['id', 'user', 'post', 'date_saved']
         read_only_fields = ['user', 'date_saved']
+        list_serializer_class = SavedPostListSerializer
 
-class RessourceSerializer(serializers.ModelSerializer):
+class RessourceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     media = serializers.FileField(required=False, allow_null=True)
-    user = UserSerializer(read_only=True)
+    user = AuthorSerializer(read_only=True)
     class Meta:
         model = Ressources
         fields = ['id','user','date_creation','media','title']
 
-class GroupeSerializer(serializers.ModelSerializer):
+class GroupeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     admin_username = serializers.ReadOnlyField(source='admin.username')
-    members = UserSerializer(source='users', many=True, read_only=True)
+    members = AuthorSerializer(source='users', many=True, read_only=True)
 
     class Meta:
         model = Groupe
         fields = ['id', 'admin', 'nom', 'bio', 'admin_username', 'users','members', 'profile_picture']
         read_only_fields = ['admin']
 
-class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
+class GroupSearchSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Public metadata of a group, with a member count instead of the members"""
+    admin_username = serializers.ReadOnlyField(source='admin.username')
+    member_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Groupe
+        fields = ['id', 'admin', 'nom', 'bio', 'admin_username', 'profile_picture', 'member_count']
+
+class MessageSerializer(NormalizedAuthorMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    author_field = 'sender'
+    sender = AuthorSerializer(read_only=True)
+    read = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'conversation', 'sender', 'content', 'timestamp', 'read']
-        read_only_fields = ['id', 'sender', 'timestamp', 'read']
+        read_only_fields = ['id', 'sender', 'timestamp']
+
+    def get_read(self, obj):
+        # Lists pass the conversation's watermarks in context['read_marks']
+        marks = self.context.get('read_marks')
+        if marks is None:
+            marks = chat.read_marks(obj.conversation_id)
+        return chat.is_read(obj, marks)
 
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -143,17 +283,22 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ['id', 'initiator', 'receiver', 'start_timestamp', 'last_message', 'unread_count']
         read_only_fields = ['start_timestamp']
     
+    def get_inbox(self, obj):
+        """The viewer's inbox row; the conversation list attaches it, other views look it up"""
+        if not hasattr(obj, 'inbox'):
+            user = self.context.get('request').user if self.context.get('request') else None
+            obj.inbox = obj.participants.filter(user_id=getattr(user, 'pk', None)).select_related('last_message__sender').first()
+        return obj.inbox
+
     def get_last_message(self, obj):
-        last_message = obj.messages.order_by('-timestamp').first()
-        if last_message:
-            return MessageSerializer(last_message).data
-        return None
+        inbox = self.get_inbox(obj)
+        if inbox is None or inbox.last_message is None:
+            return None
+        return MessageSerializer(inbox.last_message, context={'read_marks': getattr(obj, 'read_marks', None)}).data
     
     def get_unread_count(self, obj):
-        user = self.context.get('request').user if self.context.get('request') else None
-        if not user:
-            return 0
-        return obj.messages.filter(read=False).exclude(sender=user).count()
+        inbox = self.get_inbox(obj)
+        return inbox.unread_count if inbox is not None else 0
     
 
 class ReportsCreateSerializer(serializers.ModelSerializer):
@@ -171,4 +316,6 @@ class ReportsListSerializer(serializers.ModelSerializer):
         fields = ["id", "user_reported", "post_reported", "cause", "reports_count"]
 
     def get_reports_count(self, obj):
-        return Reports.objects.filter(post_reported=obj.post_reported).count()
+        if hasattr(obj, 'reports_count'):
+            return obj.reports_count
+        return Reports.objects.filter(post_reported_id=obj.post_reported_id).count()
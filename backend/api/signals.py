@@ -0,0 +1,170 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_save
+from django.utils import timezone
+
+from . import authentication, chat, search, timeline, trending
+from .cache import response_cache
+from .models import Commentaire, Conversation, Groupe, Likes, Posts, SavedPost, User
+
+# Row model -> Posts counter column it feeds
+POST_COUNTERS = {
+    Likes: 'likes_count',
+    Commentaire: 'comments_count',
+    SavedPost: 'saves_count',
+}
+
+
+def increment_post_counter(sender, instance, created, **kwargs):
+    if not created or instance.post_id is None:
+        return
+    field = POST_COUNTERS[sender]
+    Posts.objects.filter(pk=instance.post_id).update(**{field: F(field) + 1}, version=F('version') + 1)
+
+
+def decrement_post_counter(sender, instance, **kwargs):
+    if instance.post_id is None:
+        return
+    field = POST_COUNTERS[sender]
+    Posts.objects.filter(pk=instance.post_id, **{f'{field}__gt': 0}).update(**{field: F(field) - 1}, version=F('version') + 1)
+
+
+for model in POST_COUNTERS:
+    post_save.connect(increment_post_counter, sender=model, dispatch_uid=f'increment_{model.__name__}_counter')
+    post_delete.connect(decrement_post_counter, sender=model, dispatch_uid=f'decrement_{model.__name__}_counter')
+
+
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        # Keeps the fan-out writes out of the transaction that saved the post
+        transaction.on_commit(partial(timeline.fan_out, instance))
+
+
+def backfill_new_user(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance)
+
+
+def sync_group_timelines(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    # Forward: groupe.users.add(user); reverse: user.member_groups.add(groupe)
+    if reverse:
+        pairs = [(instance, groupe) for groupe in Groupe.objects.filter(pk__in=pk_set)]
+    else:
+        pairs = [(user, instance) for user in User.objects.filter(pk__in=pk_set)]
+    for user, groupe in pairs:
+        if action == 'post_add':
+            timeline.backfill(user, groupe)
+        else:
+            timeline.remove_group(user, groupe)
+
+
+post_save.connect(fan_out_post, sender=Posts, dispatch_uid='fan_out_post')
+post_save.connect(backfill_new_user, sender=User, dispatch_uid='backfill_new_user')
+m2m_changed.connect(sync_group_timelines, sender=Groupe.users.through, dispatch_uid='sync_group_timelines')
+
+
+def bump_post_versions(post_id, author_id=None):
+    if author_id is None:
+        author_id = Posts.objects.filter(pk=post_id).values_list('user_id', flat=True).first()
+    response_cache.bump(f'post:{post_id}', f'user_posts:{author_id}')
+
+
+def post_changed(sender, instance, **kwargs):
+    bump_post_versions(instance.pk, instance.user_id)
+
+
+def post_activity_changed(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        bump_post_versions(instance.post_id)
+
+
+def user_changed(sender, instance, **kwargs):
+    response_cache.bump(f'user:{instance.pk}', f'user_posts:{instance.pk}')
+    authentication.forget_user(instance.pk)
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Membership is part of the group's ETag (see api/conditional.py)
+        group_ids = pk_set if reverse else [instance.pk]
+        if group_ids:
+            Groupe.objects.filter(pk__in=group_ids).update(date_modification=timezone.now())
+
+
+for event, signal in (('save', post_save), ('delete', post_delete)):
+    signal.connect(post_changed, sender=Posts, dispatch_uid=f'post_changed_on_{event}')
+    signal.connect(user_changed, sender=User, dispatch_uid=f'user_changed_on_{event}')
+    for model in POST_COUNTERS:
+        signal.connect(post_activity_changed, sender=model, dispatch_uid=f'{model.__name__}_changed_on_{event}')
+m2m_changed.connect(membership_changed, sender=Groupe.users.through, dispatch_uid='membership_changed')
+
+
+def record_trending_event(sender, instance, created, **kwargs):
+    if created and instance.post_id is not None:
+        trending.record(instance.post_id, trending.WEIGHTS[sender])
+
+
+def retract_trending_event(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        trending.retract(instance.post_id, trending.WEIGHTS[sender])
+
+
+for model in trending.WEIGHTS:
+    post_save.connect(record_trending_event, sender=model, dispatch_uid=f'record_{model.__name__}_trending')
+    post_delete.connect(retract_trending_event, sender=model, dispatch_uid=f'retract_{model.__name__}_trending')
+
+
+def prepare_document(sender, instance, **kwargs):
+    search.indexes[sender].prepare(instance)
+
+
+def index_document(sender, instance, **kwargs):
+    search.indexes[sender].sync(instance.pk, instance.search_document, getattr(instance, '_previous_document', None))
+
+
+def unindex_document(sender, instance, **kwargs):
+    search.indexes[sender].remove(instance.pk, instance.__dict__.get('search_document'))
+
+
+def remember_indexed_fields(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not fetched just for this
+    instance._indexed_fields = {field: instance.__dict__.get(field) for field in search.users.fields}
+
+
+def reindex_user(sender, instance, created, **kwargs):
+    changed = {
+        field for field, value in instance._indexed_fields.items()
+        if field in instance.__dict__ and instance.__dict__[field] != value
+    }
+    if created or changed:
+        search.users.sync(instance, {field: '' for field in search.users.fields} if created else instance._indexed_fields)
+    # Post documents include the author's username
+    if not created and 'username' in changed:
+        search.posts.reindex(Posts.objects.filter(user=instance).select_related('user'))
+    remember_indexed_fields(sender, instance)
+
+
+for model, index in search.indexes.items():
+    pre_save.connect(prepare_document, sender=model, dispatch_uid=f'prepare_{index.kind}_document')
+    post_save.connect(index_document, sender=model, dispatch_uid=f'index_{index.kind}_document')
+    post_delete.connect(unindex_document, sender=model, dispatch_uid=f'unindex_{index.kind}_document')
+post_init.connect(remember_indexed_fields, sender=User, dispatch_uid='remember_indexed_fields')
+post_save.connect(reindex_user, sender=User, dispatch_uid='reindex_user')
+
+
+def conversation_changed(sender, instance, **kwargs):
+    chat.forget_conversation(instance.pk)
+
+
+def add_participants(sender, instance, created, **kwargs):
+    if created:
+        chat.create_participants(instance)
+
+
+for event, signal in (('save', post_save), ('delete', post_delete)):
+    signal.connect(conversation_changed, sender=Conversation, dispatch_uid=f'conversation_changed_on_{event}')
+post_save.connect(add_participants, sender=Conversation, dispatch_uid='add_participants')
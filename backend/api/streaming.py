@@ -0,0 +1,53 @@
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """
+    Yield the rows of `queryset` in pk order, `chunk_size` at a time, with
+    one bounded `pk > last` query per chunk. Unlike QuerySet.iterator(),
+    this keeps memory flat on MySQL too, whose driver buffers the whole
+    result set of a query.
+    """
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+class StreamingJSONListResponse(StreamingHttpResponse):
+    """
+    A JSON array of `serializer_class` rows, written out chunk by chunk so
+    the first byte leaves right away and only one chunk is held in memory.
+
+    Under ASGI, Django would read a synchronous iterator to the end before
+    sending anything, so `__aiter__` fetches and serializes each chunk
+    through sync_to_async instead.
+    """
+    def __init__(self, queryset, serializer_class, context=None, chunk_size=500, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        self.encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        self.source = (queryset, serializer_class, context or {}, chunk_size)
+        super().__init__(self.stream(*self.source), **kwargs)
+
+    def stream(self, queryset, serializer_class, context, chunk_size):
+        yield b'['
+        separator = b''
+        for chunk in iterate_in_chunks(queryset, chunk_size):
+            rows = serializer_class(chunk, many=True, context=context).data
+            yield separator + b','.join(self.encoder.encode(row).encode() for row in rows)
+            separator = b','
+        yield b']'
+
+    async def __aiter__(self):
+        parts = self.stream(*self.source)
+        next_part = sync_to_async(next)
+        while (part := await next_part(parts, None)) is not None:
+            yield part
@@ -1,3 +1,1339 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.db import DatabaseError, IntegrityError, OperationalError
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import close_old_connections
+from django.test import TestCase, TransactionTestCase
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import authentication, chat, search, timeline, trending
+from .cache import LRUCache, response_cache
+from .layers import DatabaseChannelLayer
+from .consumers import ChatConsumer
+from .middleware import JWTAuthMiddleware
+from .pagination import KeysetPagination
+from .models import ChannelMessage, Commentaire, Conversation, ConversationParticipant, Groupe, Likes, Message, PostScore, Posts, Reports, Ressources, SavedPost, SearchTerm, TimelineEntry, User
+from .serializers import ReportsListSerializer, UserSerializer
+from .streaming import StreamingJSONListResponse
+
+
+def publish(**fields):
+    """Create a post and run its timeline fan-out, which waits for the commit."""
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        return Posts.objects.create(**fields)
+
+
+class PostsQueryBudgetTests(TestCase):
+    """
+    Every endpoint that serializes PostsSerializer must run a fixed number
+    of queries, however many posts end up in the response.
+    """
+
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.group = Groupe.objects.create(nom='Club', admin=self.viewer)
+        self.group.users.add(self.viewer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def create_posts(self, count, author=None):
+        Posts.objects.all().delete()
+        User.objects.exclude(pk=self.viewer.pk).delete()
+        for i in range(count):
+            reporter = User.objects.create(username=f'author{i}', email=f'author{i}@emsi.ma')
+            post = publish(user=author or reporter, contenu_texte=f'cours {i}', groupe=self.group)
+            Likes.objects.create(post=post, user=self.viewer)
+            Commentaire.objects.create(post=post, user=reporter, content='ok')
+            SavedPost.objects.create(post=post, user=self.viewer)
+            Reports.objects.create(post_reported=post, user_reported=reporter)
+
+    def assert_budget(self, budget, url, params=None, author=None):
+        for count in (2, 10):
+            self.create_posts(count, author)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url, params or {})
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+
+    def test_feed(self):
+        self.assert_budget(4, '/api/posts/')
+
+    def test_feed_cursor_page(self):
+        self.assert_budget(4, '/api/posts/', {'limit': 50})
+
+    def test_user_posts(self):
+        self.assert_budget(5, f'/api/post/user/{self.viewer.id}/', author=self.viewer)
+
+    def test_group_posts(self):
+        self.assert_budget(4, f'/api/groups/{self.group.id}/posts/')
+
+    def test_saved_posts(self):
+        self.assert_budget(3, '/api/saved-posts/')
+
+    def test_search_posts(self):
+        # The index lookup, then the same three queries as any post list
+        self.assert_budget(4, '/api/posts/search/', {'query': 'cours'})
+
+    def test_reports(self):
+        self.assert_budget(1, '/api/reports/')
+
+
+class ViewerStateTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_feed_embeds_like_and_save_flags(self):
+        liked = publish(user=self.viewer, contenu_texte='liked')
+        saved = publish(user=self.viewer, contenu_texte='saved')
+        Likes.objects.create(post=liked, user=self.viewer)
+        SavedPost.objects.create(post=saved, user=self.viewer)
+
+        response = self.client.get('/api/posts/')
+
+        flags = {post['id']: (post['user_has_liked'], post['user_has_saved']) for post in response.data}
+        self.assertEqual(flags, {liked.id: (True, False), saved.id: (False, True)})
+
+    def test_batch_status(self):
+        post = Posts.objects.create(user=self.viewer, contenu_texte='cours')
+        other = Posts.objects.create(user=self.viewer, contenu_texte='td')
+        Likes.objects.create(post=post, user=self.viewer)
+
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/posts/status/', {'ids': [post.id, other.id, 999]}, format='json')
+
+        statuses = {row['id']: row for row in response.data['posts']}
+        self.assertEqual(set(statuses), {post.id, other.id})
+        self.assertTrue(statuses[post.id]['user_has_liked'])
+        self.assertEqual(statuses[post.id]['num_likes'], 1)
+        self.assertFalse(statuses[other.id]['user_has_saved'])
+
+    def test_batch_status_hides_private_group_posts(self):
+        author = User.objects.create(username='author', email='author@emsi.ma')
+        group = Groupe.objects.create(nom='Club', admin=author)
+        hidden = Posts.objects.create(user=author, contenu_texte='club', groupe=group)
+
+        response = self.client.post('/api/posts/status/', {'ids': [hidden.id]}, format='json')
+        self.assertEqual(response.data['posts'], [])
+
+        group.users.add(self.viewer)
+        response = self.client.post('/api/posts/status/', {'ids': [hidden.id]}, format='json')
+        self.assertEqual([row['id'] for row in response.data['posts']], [hidden.id])
+
+    def test_batch_status_rejects_oversized_batches(self):
+        response = self.client.post('/api/posts/status/', {'ids': list(range(501))}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PostCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@emsi.ma')
+        self.reader = User.objects.create(username='reader', email='reader@emsi.ma')
+        self.post = Posts.objects.create(user=self.author, contenu_texte='cours')
+
+    def counters(self, post=None):
+        return Posts.objects.values_list('likes_count', 'comments_count', 'saves_count').get(pk=(post or self.post).pk)
+
+    def add_activity(self, user):
+        return [
+            Likes.objects.create(post=self.post, user=user),
+            Commentaire.objects.create(post=self.post, user=user, content='ok'),
+            SavedPost.objects.create(post=self.post, user=user),
+        ]
+
+    def test_rows_increment_and_decrement_their_counter(self):
+        like, comment, save = self.add_activity(self.reader)
+        self.assertEqual(self.counters(), (1, 1, 1))
+
+        like.delete()
+        self.assertEqual(self.counters(), (0, 1, 1))
+        comment.delete()
+        self.assertEqual(self.counters(), (0, 0, 1))
+        save.delete()
+        self.assertEqual(self.counters(), (0, 0, 0))
+
+        # Never below zero, even if a counter has drifted
+        Likes.objects.create(post=self.post, user=self.reader)
+        Posts.objects.filter(pk=self.post.pk).update(likes_count=0)
+        Likes.objects.filter(post=self.post).delete()
+        self.assertEqual(self.counters(), (0, 0, 0))
+
+    def test_deleting_a_user_decrements_through_the_cascade(self):
+        self.add_activity(self.reader)
+        self.add_activity(self.author)
+        self.assertEqual(self.counters(), (2, 2, 2))
+
+        self.reader.delete()
+        self.assertEqual(self.counters(), (1, 1, 1))
+
+    def test_deleting_a_post_cascades_its_rows(self):
+        self.add_activity(self.reader)
+        other = Posts.objects.create(user=self.author, contenu_texte='td')
+        Likes.objects.create(post=other, user=self.reader)
+
+        self.post.delete()
+        self.assertFalse(Likes.objects.filter(post_id=self.post.pk).exists())
+        self.assertEqual(self.counters(other), (1, 0, 0))
+
+    def recount(self, *args):
+        out = StringIO()
+        call_command('recount_post_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def test_recount_repairs_drift(self):
+        self.add_activity(self.reader)
+        healthy = Posts.objects.create(user=self.author, contenu_texte='td')
+        Posts.objects.filter(pk=self.post.pk).update(likes_count=5, comments_count=0)
+
+        output = self.recount('--dry-run')
+        self.assertIn(f'Post {self.post.pk}: likes_count 5 -> 1, comments_count 0 -> 1', output)
+        self.assertIn('1 post(s) would be repaired.', output)
+        self.assertEqual(self.counters(), (5, 0, 1))
+
+        version = Posts.objects.get(pk=self.post.pk).version
+        response_cache.set('detail', {}, response_cache.versions(f'post:{self.post.pk}'))
+        output = self.recount('--batch-size', '1')
+        self.assertNotIn(f'Post {healthy.pk}', output)
+        self.assertIn('1 post(s) repaired.', output)
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assertEqual(Posts.objects.get(pk=self.post.pk).version, version + 1)
+        self.assertIsNone(response_cache.get('detail'))
+        self.assertIn('0 post(s) repaired.', self.recount())
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@emsi.ma')
+        self.reader = User.objects.create(username='reader', email='reader@emsi.ma')
+        self.group = Groupe.objects.create(nom='Club', admin=self.author)
+        self.group.users.add(self.author)
+
+    def feed_ids(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by('-date_creation').values_list('post_id', flat=True))
+
+    def test_public_posts_reach_everyone(self):
+        post = publish(user=self.author, contenu_texte='annonce')
+        self.assertEqual(self.feed_ids(self.reader), [post.id])
+
+    def test_group_posts_only_reach_members(self):
+        post = publish(user=self.author, contenu_texte='club', groupe=self.group)
+        self.assertEqual(self.feed_ids(self.author), [post.id])
+        self.assertEqual(self.feed_ids(self.reader), [])
+
+    def test_joining_and_leaving_a_group(self):
+        post = Posts.objects.create(user=self.author, contenu_texte='club', groupe=self.group)
+        self.group.users.add(self.reader)
+        self.assertEqual(self.feed_ids(self.reader), [post.id])
+        self.reader.member_groups.remove(self.group)
+        self.assertEqual(self.feed_ids(self.reader), [])
+
+    def test_new_users_get_recent_public_posts(self):
+        post = Posts.objects.create(user=self.author, contenu_texte='annonce')
+        newcomer = User.objects.create(username='newcomer', email='newcomer@emsi.ma')
+        self.assertEqual(self.feed_ids(newcomer), [post.id])
+
+    def test_fan_out_waits_for_the_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            post = Posts.objects.create(user=self.author, contenu_texte='annonce')
+        self.assertEqual(self.feed_ids(self.reader), [])
+        callbacks[0]()
+        self.assertEqual(self.feed_ids(self.reader), [post.id])
+
+    def test_periodic_trim_caps_every_timeline(self):
+        posts = [publish(user=self.author, contenu_texte=str(i)) for i in range(6)]
+        with mock.patch.object(timeline, 'MAX_LENGTH', 3):
+            call_command('rebuild_timelines', '--trim-only', stdout=StringIO())
+
+        self.assertEqual(self.feed_ids(self.reader), [post.id for post in posts[:2:-1]])
+        self.assertEqual(TimelineEntry.objects.count(), 6)
+
+    def test_trim_keeps_the_newest_entries(self):
+        posts = [publish(user=self.author, contenu_texte=str(i)) for i in range(5)]
+        with mock.patch.object(timeline, 'MAX_LENGTH', 2):
+            timeline.trim(self.reader)
+        self.assertEqual(sorted(self.feed_ids(self.reader)), [posts[3].id, posts[4].id])
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        trending.top_posts.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_scores_follow_engagement_incrementally(self):
+        quiet = Posts.objects.create(user=self.viewer, contenu_texte='quiet')
+        busy = Posts.objects.create(user=self.viewer, contenu_texte='busy')
+        Likes.objects.create(post=quiet, user=self.viewer)
+        Likes.objects.create(post=busy, user=self.viewer)
+        Commentaire.objects.create(post=busy, user=self.viewer, content='ok')
+
+        self.assertAlmostEqual(trending.score(PostScore.objects.get(post=busy).rank_key), 4, places=3)
+        self.assertEqual(trending.top_ids(), [busy.id, quiet.id])
+
+        Commentaire.objects.filter(post=busy).delete()
+        Likes.objects.filter(post=quiet).delete()
+        self.assertAlmostEqual(trending.score(PostScore.objects.get(post=busy).rank_key), 1, places=3)
+        self.assertFalse(PostScore.objects.filter(post=quiet).exists())
+
+    def test_older_engagement_decays(self):
+        old = Posts.objects.create(user=self.viewer, contenu_texte='old')
+        new = Posts.objects.create(user=self.viewer, contenu_texte='new')
+        trending.record(old.id, 3, when=timezone.now() - timedelta(seconds=2 * trending.HALF_LIFE))
+        trending.record(new.id, 1)
+
+        self.assertAlmostEqual(trending.score(PostScore.objects.get(post=old).rank_key), 0.75, places=3)
+        self.assertEqual(trending.top_ids(), [new.id, old.id])
+
+        self.assertEqual(trending.prune(timezone.now() + timedelta(seconds=4 * trending.HALF_LIFE)), 1)
+        self.assertEqual(list(PostScore.objects.values_list('post_id', flat=True)), [new.id])
+
+    def test_group_posts_are_not_ranked(self):
+        group = Groupe.objects.create(nom='Club', admin=self.viewer)
+        post = Posts.objects.create(user=self.viewer, contenu_texte='cours', groupe=group)
+        Likes.objects.create(post=post, user=self.viewer)
+        self.assertFalse(PostScore.objects.exists())
+
+    def test_endpoint_reads_the_cached_ranking(self):
+        posts = [Posts.objects.create(user=self.viewer, contenu_texte=str(i)) for i in range(3)]
+        for weight, post in enumerate(posts, start=1):
+            trending.record(post.id, weight)
+        trending.top_ids()
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/posts/trending/', {'limit': 2})
+        self.assertEqual([post['id'] for post in response.data], [posts[2].id, posts[1].id])
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.post = Posts.objects.create(user=self.viewer, contenu_texte='cours')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def comment(self, post=None, **kwargs):
+        return Commentaire.objects.create(post=post or self.post, user=self.viewer, content='ok', **kwargs)
+
+    def test_pages_oldest_first_in_one_query(self):
+        comments = [self.comment() for _ in range(5)]
+        url = f'/api/posts/{self.post.id}/comments/'
+
+        with self.assertNumQueries(2):
+            first = self.client.get(url, {'limit': 3}).data
+        second = self.client.get(url, {'limit': 3, 'cursor': first['next']}).data
+
+        ids = [comment['id'] for comment in first['results'] + second['results']]
+        self.assertEqual(ids, [comment.id for comment in comments])
+        self.assertIsNone(second['next'])
+
+    def test_replies(self):
+        root = self.comment()
+        response = self.client.post(f'/api/posts/{self.post.id}/comments/create/', {'content': 're', 'parent': root.id})
+        self.assertEqual(response.data['parent'], root.id)
+        self.comment(parent=root)
+
+        top = self.client.get(f'/api/posts/{self.post.id}/comments/', {'parent': 'root'}).data
+        self.assertEqual([(c['id'], c['reply_count']) for c in top], [(root.id, 2)])
+        replies = self.client.get(f'/api/posts/{self.post.id}/comments/', {'parent': root.id}).data
+        self.assertEqual(len(replies), 2)
+
+        other = Posts.objects.create(user=self.viewer, contenu_texte='td')
+        response = self.client.post(f'/api/posts/{other.id}/comments/create/', {'content': 're', 'parent': root.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_preview_takes_the_first_comments_of_each_post(self):
+        other = Posts.objects.create(user=self.viewer, contenu_texte='td')
+        group = Groupe.objects.create(nom='Club')
+        hidden = Posts.objects.create(user=User.objects.create(username='x', email='x@emsi.ma'), contenu_texte='x', groupe=group)
+        first = [self.comment() for _ in range(4)]
+        reply = self.comment(parent=first[0])
+        self.comment(post=other)
+        self.comment(post=hidden)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/comments/preview/', {'posts': f'{self.post.id},{other.id},{hidden.id}', 'count': 2})
+
+        self.assertEqual([c['id'] for c in response.data[str(self.post.id)]], [first[0].id, first[1].id])
+        self.assertNotIn(reply.id, [c['id'] for c in response.data[str(self.post.id)]])
+        self.assertEqual(len(response.data[str(other.id)]), 1)
+        self.assertEqual(response.data[str(hidden.id)], [])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.group = Groupe.objects.create(nom='Club', admin=self.viewer)
+        self.posts = [Posts.objects.create(user=self.viewer, contenu_texte=str(i), groupe=self.group) for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def traverse(self, url, key, insert=False):
+        ids, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids += [post['id'] for post in response.data[key]]
+            cursor = response.data['next']
+            if not cursor:
+                return ids
+            if insert:
+                Posts.objects.create(user=self.viewer, contenu_texte='new', groupe=self.group)
+                insert = False
+
+    def assert_keyset(self, url, key):
+        expected = [post.id for post in reversed(self.posts)]
+        self.assertEqual(self.traverse(url, key), expected)
+        self.assertEqual(self.traverse(url, key, insert=True), expected)
+
+        for cursor in ('garbage', KeysetPagination().encode_values(['bogus', 'x']), KeysetPagination().encode_values([None, 1])):
+            response = self.client.get(url, {'limit': 2, 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_user_posts(self):
+        self.assert_keyset(f'/api/post/user/{self.viewer.id}/', 'posts')
+
+    def test_group_posts(self):
+        self.assert_keyset(f'/api/groups/{self.group.id}/posts/', 'results')
+
+    def test_invalid_cursors_on_other_lists(self):
+        cursor = KeysetPagination().encode_values(['bogus', 'x'])
+        for url in ('/api/posts/', f'/api/posts/{self.posts[0].id}/comments/', '/api/conversations/'):
+            response = self.client.get(url, {'limit': 2, 'cursor': cursor})
+            self.assertEqual(response.status_code, 404, url)
+
+
+class PostSearchTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def post(self, text):
+        return Posts.objects.create(user=self.viewer, contenu_texte=text)
+
+    def search(self, query, **params):
+        return [post['id'] for post in self.client.get('/api/posts/search/', {'query': query, **params}).data]
+
+    def test_folds_accents_and_matches_prefixes(self):
+        post = self.post('Cours d\'économie générale')
+        self.post('Club théâtre')
+
+        self.assertEqual(self.search('ECONOMIE generale'), [post.id])
+        self.assertEqual(self.search('écon'), [post.id])
+        self.assertEqual(self.search('econ '), [])
+
+    def test_index_follows_edits_deletes_and_renames(self):
+        post = self.post('examen')
+        post.contenu_texte = 'rattrapage'
+        post.save()
+        self.assertEqual(self.search('examen'), [])
+        self.assertEqual(self.search('rattrapage'), [post.id])
+
+        self.viewer.username = 'renamed'
+        self.viewer.save()
+        self.assertEqual(self.search('renamed'), [post.id])
+
+        post.delete()
+        self.assertEqual(self.search('rattrapage'), [])
+
+    def test_cursor_pages_are_stable(self):
+        posts = [self.post('stage') for _ in range(5)]
+        first = self.client.get('/api/posts/search/', {'query': 'stage', 'limit': 3}).data
+        second = self.client.get('/api/posts/search/', {'query': 'stage', 'cursor': first['next'], 'limit': 3}).data
+
+        ids = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(ids, [post.id for post in reversed(posts)])
+        self.assertIsNone(second['next'])
+
+    def test_term_index_fallback(self):
+        with mock.patch.object(search, 'BACKEND', 'terms'):
+            stage = self.post('Stage de fin d\'études, stage PFE')
+            self.post('Offre de stage été')
+            self.post('Études')
+
+            self.assertEqual(search.posts.search('etudes stag'), [stage.id])
+            self.assertEqual(len(search.posts.search('stage')), 2)
+            self.assertEqual(search.posts.search('stage')[0], stage.id)
+            self.assertFalse(SearchTerm.objects.filter(term='de').exists())
+
+    def test_fulltext_expression_skips_unindexed_short_words(self):
+        self.assertEqual(search.fulltext_expression(['td', 'reseau'], False), '+reseau')
+        self.assertEqual(search.fulltext_expression(['reseau', 'td'], True), '+reseau +td*')
+        self.assertEqual(search.fulltext_expression(['td'], False), '')
+
+
+class UserAutocompleteTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.mohcine = User.objects.create(username='mohcine20', email='m.elamrani@emsi.ma', first_name='Mohcine', last_name='El Amrani')
+        self.other = User.objects.create(username='salma', email='salma@emsi.ma', first_name='Salma', last_name='Idrissi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def search(self, query):
+        return [user['id'] for user in self.client.get('/api/users/search/', {'query': query}).data]
+
+    def test_matches_names_prefixes_and_typos(self):
+        self.assertEqual(self.search('moh'), [self.mohcine.id])
+        self.assertEqual(self.search('amrani'), [self.mohcine.id])
+        self.assertEqual(self.search('elamr'), [self.mohcine.id])
+        self.assertEqual(self.search('mohcnie'), [self.mohcine.id])
+        self.assertEqual(self.search('Idrîssi'), [self.other.id])
+
+    def test_index_follows_profile_changes_only(self):
+        self.other.last_name = 'Bennani'
+        self.other.save()
+        self.assertEqual(self.search('bennani'), [self.other.id])
+        self.assertEqual(self.search('idrissi'), [])
+
+        with self.assertNumQueries(1):
+            self.other.save(update_fields=['last_login'])
+
+    def test_single_indexed_query(self):
+        with self.assertNumQueries(1):
+            ids = search.users.search('salma')
+        self.assertEqual(ids, [self.other.id])
+
+
+class GroupSearchTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_ranked_metadata_with_member_counts(self):
+        club = Groupe.objects.create(nom='Club Robotique', bio='Robotique et électronique', admin=self.viewer)
+        other = Groupe.objects.create(nom='Club Théâtre', bio='Improvisation')
+        Groupe.objects.create(nom='BDE')
+        for i in range(3):
+            club.users.add(User.objects.create(username=f'member{i}', email=f'member{i}@emsi.ma'))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/groups/search/', {'query': 'robotique'})
+        self.assertEqual(response.data, [{
+            'id': club.id, 'admin': self.viewer.id, 'nom': 'Club Robotique', 'bio': 'Robotique et électronique',
+            'admin_username': 'viewer', 'profile_picture': None, 'member_count': 3,
+        }])
+
+        first = self.client.get('/api/groups/search/', {'query': 'club', 'limit': 1}).data
+        second = self.client.get('/api/groups/search/', {'query': 'club', 'limit': 1, 'cursor': first['next']}).data
+        self.assertEqual({first['results'][0]['id'], second['results'][0]['id']}, {club.id, other.id})
+        self.assertIsNone(second['next'])
+
+    def test_index_follows_edits(self):
+        groupe = Groupe.objects.create(nom='Club Échecs')
+        self.assertEqual(len(self.client.get('/api/groups/search/', {'query': 'echecs'}).data), 1)
+        groupe.nom = 'Club Go'
+        groupe.save()
+        self.assertEqual(self.client.get('/api/groups/search/', {'query': 'echecs'}).data, [])
+        groupe.delete()
+        self.assertEqual(self.client.get('/api/groups/search/', {'query': 'go'}).data, [])
+
+
+class SearchVisibilityTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.admin = User.objects.create(username='admin', email='admin@emsi.ma')
+        self.outsider = User.objects.create(username='outsider', email='outsider@emsi.ma')
+        groupe = Groupe.objects.create(nom='Bureau', admin=self.admin)
+        groupe.users.add(self.admin)
+        self.private = Posts.objects.create(user=self.admin, contenu_texte='Budget confidentiel', groupe=groupe)
+        self.public = Posts.objects.create(user=self.admin, contenu_texte='Annonce confidentiel levée')
+        self.client = APIClient()
+
+    @mock.patch.object(search, 'executor', None)
+    def search(self, user):
+        self.client.force_authenticate(user)
+        found = [post['id'] for post in self.client.get('/api/posts/search/', {'query': 'confidentiel'}).data]
+        sections = self.client.get('/api/search/', {'query': 'confidentiel', 'types': 'posts'}).data['sections']
+        return sorted(found), sorted(post['id'] for post in sections[0]['results'])
+
+    def test_private_group_posts_are_hidden_from_non_members(self):
+        self.assertEqual(self.search(self.outsider), ([self.public.id], [self.public.id]))
+        both = sorted([self.public.id, self.private.id])
+        self.assertEqual(self.search(self.admin), (both, both))
+
+
+class UnifiedSearchTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    @mock.patch.object(search, 'executor', None)
+    def test_one_ranked_section_per_type(self):
+        post = Posts.objects.create(user=self.viewer, contenu_texte='Examen de réseaux')
+        student = User.objects.create(username='reseaux_club', email='rc@emsi.ma')
+        groupe = Groupe.objects.create(nom='Club Réseaux')
+        ressource = Ressources.objects.create(user=self.viewer, title='Cours réseaux TCP/IP')
+
+        response = self.client.get('/api/search/', {'query': 'reseaux'})
+
+        sections = {section['type']: section for section in response.data['sections']}
+        self.assertEqual(list(sections), ['posts', 'users', 'groups', 'resources'])
+        self.assertEqual([row['id'] for row in sections['posts']['results']], [post.id])
+        self.assertEqual([row['id'] for row in sections['users']['results']], [student.id])
+        self.assertEqual([row['id'] for row in sections['groups']['results']], [groupe.id])
+        self.assertEqual([row['id'] for row in sections['resources']['results']], [ressource.id])
+        self.assertTrue(all(section['status'] == 'ok' for section in sections.values()))
+
+        response = self.client.get('/api/search/', {'query': 'reseaux', 'types': 'groups'})
+        self.assertEqual([section['type'] for section in response.data['sections']], ['groups'])
+
+    def test_slow_section_times_out_without_holding_the_others(self):
+        release = threading.Event()
+        tasks = {'slow': lambda: release.wait(5), 'fast': lambda: ['hit'], 'broken': lambda: 1 / 0}
+
+        started = time.monotonic()
+        with self.assertLogs('api.search', 'ERROR'):
+            results = search.gather(tasks, timeout=0.1)
+        release.set()
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(results, {'slow': ('timeout', None), 'fast': ('ok', ['hit']), 'broken': ('error', None)})
+
+
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        search.search_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.stage = Posts.objects.create(user=self.viewer, contenu_texte='Offre de stage')
+        self.club = Posts.objects.create(user=self.viewer, contenu_texte='Club robotique')
+
+    def test_repeated_queries_hit_the_cache(self):
+        self.assertEqual(search.posts.search('STAGE'), [self.stage.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(search.posts.search('stage'), [self.stage.id])
+        self.assertEqual(search.search_cache.stats()['hits'], 1)
+
+    def test_writes_only_invalidate_matching_queries(self):
+        search.posts.search('stage')
+        search.posts.search('robot')
+
+        other = Posts.objects.create(user=self.viewer, contenu_texte='Stage PFE')
+        with self.assertNumQueries(0):
+            search.posts.search('robot')
+        self.assertEqual(search.posts.search('stage'), [other.id, self.stage.id])
+
+        self.club.contenu_texte = 'Club théâtre'
+        self.club.save()
+        self.assertEqual(search.posts.search('robot'), [])
+
+        search.posts.search('stage')
+        other.delete()
+        self.assertEqual(search.posts.search('stage'), [self.stage.id])
+
+    def test_user_changes_invalidate_by_trigram(self):
+        search.users.search('viewer')
+        search.users.search('zineb')
+        zineb = User.objects.create(username='zineb', email='z@emsi.ma')
+
+        with self.assertNumQueries(0):
+            search.users.search('viewer')
+        self.assertEqual(search.users.search('zineb'), [zineb.id])
+
+    def test_stats_are_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        self.assertEqual(client.get('/api/search/stats/').status_code, 403)
+
+        self.viewer.is_staff = True
+        search.posts.search('stage')
+        search.posts.search('stage')
+        response = client.get('/api/search/stats/')
+        self.assertEqual(response.data['hit_ratio'], 0.5)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.post = publish(user=self.viewer, contenu_texte='cours')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_repeated_feed_reads_skip_the_database(self):
+        self.client.get('/api/posts/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/posts/')
+
+    def test_like_invalidates_feed_and_detail(self):
+        self.client.get('/api/posts/')
+        self.client.get(f'/api/posts/{self.post.id}/')
+        Likes.objects.create(post=self.post, user=self.viewer)
+
+        self.assertEqual(self.client.get('/api/posts/').data[0]['num_likes'], 1)
+        self.assertTrue(self.client.get(f'/api/posts/{self.post.id}/').data['user_has_liked'])
+
+    def test_unrelated_activity_keeps_other_feeds_cached(self):
+        author = User.objects.create(username='author', email='author@emsi.ma')
+        group = Groupe.objects.create(nom='Club', admin=author)
+        hidden = Posts.objects.create(user=author, contenu_texte='club', groupe=group)
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/', {'limit': 1})
+
+        Likes.objects.create(post=hidden, user=author)
+        author.first_name = 'Renamed'
+        author.save()
+        with self.assertNumQueries(0):
+            self.client.get('/api/posts/')
+            self.client.get('/api/posts/', {'limit': 1})
+
+        public = publish(user=author, contenu_texte='annonce')
+        self.assertEqual(self.client.get('/api/posts/').data[0]['id'], public.id)
+
+    def test_fan_out_bumps_timeline_versions_in_one_call(self):
+        author = User.objects.create(username='author', email='author@emsi.ma')
+        group = Groupe.objects.create(nom='Club', admin=author)
+        with mock.patch.object(response_cache.versions_store, 'set_many', wraps=response_cache.versions_store.set_many) as set_many:
+            publish(user=author, contenu_texte='annonce')
+            publish(user=author, contenu_texte='club', groupe=group)
+
+        bumped = [set(call.args[0]) for call in set_many.call_args_list]
+        self.assertIn({response_cache.version_key(timeline.PUBLIC_TIMELINE)}, bumped)
+        self.assertIn({response_cache.version_key(f'timeline:{author.pk}')}, bumped)
+        self.assertNotIn(response_cache.version_key(f'timeline:{self.viewer.pk}'), set().union(*bumped))
+
+    def test_profile_change_invalidates_post_detail(self):
+        self.client.get(f'/api/posts/{self.post.id}/')
+        self.viewer.username = 'renamed'
+        self.viewer.save()
+        response = self.client.get(f'/api/posts/{self.post.id}/')
+        self.assertEqual(response.data['user']['username'], 'renamed')
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_entries_expire(self):
+        cache = LRUCache(timeout=10)
+        cache.set('a', 1)
+        with mock.patch('api.cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(cache.get('a'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.post = Posts.objects.create(user=self.viewer, contenu_texte='cours')
+        self.group = Groupe.objects.create(nom='Club', admin=self.viewer)
+        self.group.users.add(self.viewer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def assert_revalidates(self, url, change):
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_detail(self):
+        self.assert_revalidates(
+            f'/api/posts/{self.post.id}/',
+            lambda: Likes.objects.create(post=self.post, user=self.viewer),
+        )
+
+    def test_post_edit_changes_etag(self):
+        def edit():
+            self.post.contenu_texte = 'edited'
+            self.post.save()
+        self.assert_revalidates(f'/api/posts/{self.post.id}/', edit)
+
+    def test_user_posts(self):
+        self.assert_revalidates(
+            f'/api/post/user/{self.viewer.id}/',
+            lambda: Commentaire.objects.create(post=self.post, user=self.viewer, content='ok'),
+        )
+
+    def test_write_from_another_worker_misses_the_response_cache(self):
+        # An update() sends no signals, like a like handled by another process
+        def like_elsewhere():
+            Posts.objects.filter(pk=self.post.pk).update(likes_count=F('likes_count') + 1, version=F('version') + 1)
+
+        self.assert_revalidates(f'/api/posts/{self.post.id}/', like_elsewhere)
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/').data['num_likes'], 1)
+
+        self.client.get(f'/api/post/user/{self.viewer.id}/')
+        like_elsewhere()
+        self.assertEqual(self.client.get(f'/api/post/user/{self.viewer.id}/').data['posts'][0]['num_likes'], 2)
+
+    def test_profile(self):
+        def rename():
+            self.viewer.username = 'renamed'
+            self.viewer.save()
+        self.assert_revalidates(f'/api/users/{self.viewer.id}/', rename)
+
+    def test_group_membership(self):
+        member = User.objects.create(username='member', email='member@emsi.ma')
+        self.assert_revalidates(f'/api/groups/{self.group.id}/', lambda: self.group.users.add(member))
+
+
+class PayloadShapeTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma', bio='bio')
+        self.post = publish(user=self.viewer, contenu_texte='cours')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_posts_nest_a_slim_author_card(self):
+        response = self.client.get('/api/posts/')
+        self.assertEqual(set(response.data[0]['user']), {'id', 'username', 'profile_picture'})
+
+    def test_sparse_fieldset(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/posts/', {'fields': 'id,num_likes'})
+        self.assertEqual(response.data, [{'id': self.post.id, 'num_likes': 0}])
+
+    def test_nested_lists_have_a_fixed_query_budget(self):
+        group = Groupe.objects.create(nom='Club', admin=self.viewer)
+        for i in range(5):
+            author = User.objects.create(username=f'author{i}', email=f'author{i}@emsi.ma')
+            Commentaire.objects.create(post=self.post, user=author, content='ok')
+            Ressources.objects.create(user=author, title='td')
+            group.users.add(author)
+
+        with self.assertNumQueries(2):
+            self.client.get(f'/api/posts/{self.post.id}/comments/')
+        with self.assertNumQueries(1):
+            b''.join(self.client.get('/api/ressources/').streaming_content)
+        with self.assertNumQueries(2):
+            self.client.get('/api/groups/', {'filter': 'admin'})
+
+
+class StreamingListTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        for i in range(4):
+            User.objects.create(username=f'user{i}', email=f'user{i}@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_streams_the_same_json_as_a_plain_list(self):
+        response = self.client.get('/api/users/')
+
+        self.assertTrue(response.streaming)
+        body = json.loads(b''.join(response.streaming_content))
+        expected = UserSerializer(User.objects.order_by('pk'), many=True).data
+        self.assertEqual(body, json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+    def test_reads_one_bounded_query_per_chunk(self):
+        response = StreamingJSONListResponse(User.objects.all(), UserSerializer, chunk_size=2)
+
+        # 5 users in chunks of 2; the short last chunk ends the walk
+        with self.assertNumQueries(3):
+            body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([user['username'] for user in body], ['viewer', 'user0', 'user1', 'user2', 'user3'])
+
+    def test_empty_list(self):
+        response = StreamingJSONListResponse(Reports.objects.all(), ReportsListSerializer)
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+
+    async def test_async_client_reads_chunks_as_they_are_produced(self):
+        token = AccessToken.for_user(self.viewer)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            response = await self.async_client.get('/api/users/', headers={'Authorization': f'Bearer {token}'})
+            parts = [part async for part in response]
+
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        self.assertEqual(len(json.loads(b''.join(parts))), 5)
+
+
+class StreamingASGITests(TransactionTestCase):
+    """Django serves the view on another thread under ASGI, so rows must be committed."""
+
+    def setUp(self):
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        for i in range(4):
+            User.objects.create(username=f'user{i}', email=f'user{i}@emsi.ma')
+
+    async def test_streams_under_asgi_without_buffering(self):
+        token = AccessToken.for_user(self.viewer)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/users/', 'query_string': b'',
+            'headers': [(b'authorization', f'Bearer {token}'.encode()), (b'host', b'testserver')],
+        }
+        communicator = ApplicationCommunicator(ASGIHandler(), scope)
+        # As in AsyncClient, keep request_started from closing the test connection
+        request_started.disconnect(close_old_connections)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                await communicator.send_input({'type': 'http.request', 'body': b''})
+                start = await communicator.receive_output(timeout=5)
+                parts = []
+                while not parts or parts[-1].get('more_body'):
+                    parts.append(await communicator.receive_output(timeout=5))
+        finally:
+            request_started.connect(close_old_connections)
+
+        self.assertEqual(start['status'], 200)
+        self.assertEqual([str(warning.message) for warning in caught], [])
+        # '[', the rows, ']' and the closing empty body each went out on their own
+        self.assertGreater(len(parts), 2)
+        self.assertEqual(len(json.loads(b''.join(part.get('body', b'') for part in parts))), 5)
+
+
+class NormalizedUsersTests(TestCase):
+    def setUp(self):
+        response_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.author = User.objects.create(username='author', email='author@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_feed_lists_each_author_once(self):
+        for i in range(3):
+            publish(user=self.author, contenu_texte=str(i))
+
+        response = self.client.get('/api/posts/', {'normalize': 'users', 'limit': 10})
+
+        self.assertEqual({post['user_id'] for post in response.data['results']}, {self.author.id})
+        self.assertNotIn('user', response.data['results'][0])
+        self.assertEqual(response.data['users'], {str(self.author.id): {'id': self.author.id, 'username': 'author', 'profile_picture': None}})
+
+    def test_comments_and_messages(self):
+        post = Posts.objects.create(user=self.author, contenu_texte='cours')
+        Commentaire.objects.create(post=post, user=self.viewer, content='ok')
+        conversation = Conversation.objects.create(initiator=self.viewer, receiver=self.author)
+        Message.objects.create(conversation=conversation, sender=self.author, content='salut')
+
+        comments = self.client.get(f'/api/posts/{post.id}/comments/', {'normalize': 'users'}).data
+        messages = self.client.get(f'/api/conversation/{conversation.id}/messages/', {'normalize': 'users'}).data
+
+        self.assertEqual(comments['results'][0]['user_id'], self.viewer.id)
+        self.assertEqual(list(comments['users']), [str(self.viewer.id)])
+        self.assertEqual(messages['results'][0]['sender_id'], self.author.id)
+        self.assertEqual(list(messages['users']), [str(self.author.id)])
+
+
+class DatabaseChannelLayerTests(TestCase):
+    """Two layer instances stand in for two ASGI processes sharing the database."""
+
+    def setUp(self):
+        self.first = DatabaseChannelLayer(capacity=2, poll_interval=0.001)
+        self.second = DatabaseChannelLayer(capacity=2, poll_interval=0.001)
+
+    @async_to_sync
+    async def test_group_send_reaches_other_process(self):
+        here = await self.first.new_channel()
+        there = await self.second.new_channel()
+        await self.first.group_add('chat_1', here)
+        await self.second.group_add('chat_1', there)
+
+        await self.first.group_send('chat_1', {'type': 'chat.message', 'text': 'salut'})
+
+        self.assertEqual(await self.first.receive(here), {'type': 'chat.message', 'text': 'salut'})
+        self.assertEqual(await self.second.receive(there), {'type': 'chat.message', 'text': 'salut'})
+        await self.first.group_discard('chat_1', here)
+        await self.second.group_send('chat_1', {'type': 'chat.message', 'text': 'encore'})
+        self.assertEqual(await self.second.receive(there), {'type': 'chat.message', 'text': 'encore'})
+        self.assertEqual(await self.first.fetch_local(), [])
+
+    @async_to_sync
+    async def test_poller_survives_database_errors(self):
+        channel = await self.first.new_channel()
+        await self.first.group_add('chat_1', channel)
+        take = self.first.take
+        failures = [OperationalError('server has gone away')]
+
+        def flaky_take(queryset, limit):
+            if failures:
+                raise failures.pop()
+            return take(queryset, limit)
+
+        self.first.max_poll_interval = 0.01
+        with mock.patch.object(self.first, 'take', side_effect=flaky_take), self.assertLogs('api.layers', 'ERROR'):
+            receiving = asyncio.ensure_future(self.first.receive(channel))
+            await asyncio.sleep(0.05)
+            await self.second.group_send('chat_1', {'type': 'chat.message', 'text': 'toujours là'})
+            message = await asyncio.wait_for(receiving, 5)
+
+        self.assertEqual(failures, [])
+        self.assertEqual(message['text'], 'toujours là')
+        self.assertFalse(self.first.poller.done())
+
+    @async_to_sync
+    async def test_waiting_receive_restarts_a_stopped_poller(self):
+        self.first.poller_check_interval = 0.01
+        channel = await self.first.new_channel()
+        receiving = asyncio.ensure_future(self.first.receive(channel))
+        await asyncio.sleep(0.02)
+        self.first.poller.cancel()
+        await self.second.send(channel, {'type': 'late'})
+
+        self.assertEqual(await asyncio.wait_for(receiving, 5), {'type': 'late'})
+
+    @async_to_sync
+    async def test_capacity_and_expiry(self):
+        channel = await self.second.new_channel()
+        await self.first.send(channel, {'type': 'one'})
+        await self.first.send(channel, {'type': 'two'})
+        with self.assertRaises(ChannelFull):
+            await self.first.send(channel, {'type': 'three'})
+
+        await self.first.send('shared', {'type': 'late'})
+        expire = ChannelMessage.objects.filter(channel='shared').update
+        await database_sync_to_async(expire)(expires=timezone.now() - timedelta(seconds=1))
+        await self.first.send('shared', {'type': 'fresh'})
+
+        self.assertEqual(await self.second.receive(channel), {'type': 'one'})
+        self.assertEqual(await self.first.receive('shared'), {'type': 'fresh'})
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.tokens.clear()
+        authentication.users.clear()
+        self.user = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.token = str(AccessToken.for_user(self.user))
+        self.request = APIRequestFactory().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_repeated_requests_skip_the_users_table(self):
+        with self.assertNumQueries(1):
+            user, _ = authentication.authenticator.authenticate(self.request)
+        with self.assertNumQueries(0):
+            again, _ = authentication.authenticator.authenticate(self.request)
+        self.assertEqual((user.pk, again.pk), (self.user.pk, self.user.pk))
+        self.assertIsNot(user, again)
+        self.assertEqual(again.username, 'viewer')
+
+    def test_saving_or_deleting_the_user_invalidates(self):
+        authentication.authenticator.authenticate(self.request)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(authentication.authenticator.authenticate(self.request)[0].username, 'renamed')
+
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticator.authenticate(self.request)
+
+    def test_websocket_connect(self):
+        middleware = JWTAuthMiddleware(None)
+        user = async_to_sync(middleware.get_user)(self.token)
+        with self.assertNumQueries(0):
+            again = async_to_sync(middleware.get_user)(self.token)
+        self.assertEqual((user.pk, again.pk), (self.user.pk, self.user.pk))
+        self.assertFalse(async_to_sync(middleware.get_user)('not-a-token').is_authenticated)
+
+
+class ChatParticipantTests(TestCase):
+    def setUp(self):
+        chat.participants_cache.clear()
+        self.initiator = User.objects.create(username='initiator', email='initiator@emsi.ma')
+        self.receiver = User.objects.create(username='receiver', email='receiver@emsi.ma')
+        self.outsider = User.objects.create(username='outsider', email='outsider@emsi.ma')
+        self.conversation = Conversation.objects.create(initiator=self.initiator, receiver=self.receiver)
+
+    def test_lookup_is_cached_until_deletion(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(chat.is_participant(self.conversation.pk, self.receiver.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(chat.is_participant(str(self.conversation.pk), self.outsider.pk))
+
+        pk = self.conversation.pk
+        self.conversation.delete()
+        self.assertIsNone(chat.cached_participants(pk))
+        self.assertFalse(chat.is_participant(pk, self.receiver.pk))
+
+    @async_to_sync
+    async def connect(self, user):
+        scope = {
+            'type': 'websocket', 'path': f'/ws/chat/{self.conversation.pk}/', 'user': user,
+            'url_route': {'kwargs': {'conversation_id': str(self.conversation.pk)}},
+        }
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=5)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        return response['type'] == 'websocket.accept'
+
+    def test_only_participants_connect(self):
+        self.assertTrue(self.connect(self.initiator))
+        self.assertFalse(self.connect(self.outsider))
+
+
+class MessageWriterTests(TestCase):
+    def setUp(self):
+        chat.participants_cache.clear()
+        self.initiator = User.objects.create(username='initiator', email='initiator@emsi.ma')
+        self.receiver = User.objects.create(username='receiver', email='receiver@emsi.ma')
+        self.conversation = Conversation.objects.create(initiator=self.initiator, receiver=self.receiver)
+
+    def message(self, content, conversation_id=None):
+        return Message(conversation_id=conversation_id or self.conversation.pk, sender=self.initiator, content=content)
+
+    @async_to_sync
+    async def write(self, writer, messages):
+        return await asyncio.gather(*(writer.write(message) for message in messages), return_exceptions=True)
+
+    def test_concurrent_messages_share_one_transaction(self):
+        writer = chat.MessageWriter()
+        with mock.patch.object(writer, 'save', wraps=writer.save) as save:
+            saved = self.write(writer, [self.message(f'ligne {i}') for i in range(5)])
+
+        self.assertEqual(save.call_count, 1)
+        ids = [message.id for message in saved]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(
+            list(Message.objects.filter(conversation=self.conversation).order_by('id').values_list('content', flat=True)),
+            [f'ligne {i}' for i in range(5)],
+        )
+
+    def test_a_bad_message_fails_alone(self):
+        writer = chat.MessageWriter()
+        insert = writer.insert
+
+        def reject_lost(messages):
+            # Foreign keys are only checked at commit inside TestCase
+            if any(message.content == 'perdu' for message in messages):
+                raise IntegrityError('conversation gone')
+            insert(messages)
+
+        with mock.patch.object(writer, 'insert', side_effect=reject_lost):
+            saved = self.write(writer, [self.message('ok'), self.message('perdu')])
+
+        self.assertIsNotNone(saved[0].id)
+        self.assertIsInstance(saved[1], DatabaseError)
+        self.assertEqual(Message.objects.count(), 1)
+
+    @async_to_sync
+    async def test_socket_message_is_acked_and_broadcast(self):
+        scope = {
+            'type': 'websocket', 'path': f'/ws/chat/{self.conversation.pk}/', 'user': self.initiator,
+            'url_route': {'kwargs': {'conversation_id': str(self.conversation.pk)}},
+        }
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(timeout=5))['type'], 'websocket.accept')
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'chat_message', 'content': 'salut', 'client_id': 'c1'})})
+        ack = json.loads((await communicator.receive_output(timeout=5))['text'])
+        broadcast = json.loads((await communicator.receive_output(timeout=5))['text'])
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+        self.assertEqual(ack['client_id'], 'c1')
+        self.assertEqual(broadcast['message']['id'], ack['message_id'])
+        self.assertEqual(broadcast['message']['content'], 'salut')
+
+
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        chat.participants_cache.clear()
+        self.initiator = User.objects.create(username='initiator', email='initiator@emsi.ma')
+        self.receiver = User.objects.create(username='receiver', email='receiver@emsi.ma')
+        self.conversation = Conversation.objects.create(initiator=self.initiator, receiver=self.receiver)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.initiator, content=f'ligne {i}')
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+
+    def watermark(self, user):
+        return ConversationParticipant.objects.get(conversation=self.conversation, user=user).last_read_id
+
+    def test_read_moves_the_watermark_once(self):
+        url = f'/api/conversation/{self.conversation.pk}/read/'
+        # Conversation, last message, the single UPDATE, watermarks
+        with self.assertNumQueries(4):
+            response = self.client.post(url, {'message_ids': [m.id for m in self.messages[:3]]}, format='json')
+        self.assertEqual(response.data, {'last_read_id': self.messages[2].id})
+
+        # Never moves back, never past the last message
+        self.client.post(url, {'message_id': self.messages[0].id}, format='json')
+        self.assertEqual(self.watermark(self.receiver), self.messages[2].id)
+        self.client.post(url, {'message_id': 10 ** 9}, format='json')
+        self.assertEqual(self.watermark(self.receiver), self.messages[4].id)
+        self.assertEqual(self.client.post(url, {}, format='json').status_code, 400)
+
+    def test_read_flags_and_unread_count_follow_the_watermark(self):
+        chat.mark_read(self.conversation.pk, self.receiver.pk, self.messages[1].id)
+
+        listed = self.client.get(f'/api/conversation/{self.conversation.pk}/messages/').data
+        conversations = self.client.get('/api/conversations/').data
+
+        self.assertEqual([message['read'] for message in listed], [True, True, False, False, False])
+        self.assertEqual(conversations[0]['unread_count'], 3)
+
+    @async_to_sync
+    async def test_socket_receipts_are_coalesced(self):
+        scope = {
+            'type': 'websocket', 'path': f'/ws/chat/{self.conversation.pk}/', 'user': self.receiver,
+            'url_route': {'kwargs': {'conversation_id': str(self.conversation.pk)}},
+        }
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), scope)
+        with mock.patch.object(chat, 'READ_RECEIPT_DELAY', 0.05), mock.patch.object(chat, 'mark_read', wraps=chat.mark_read) as mark_read:
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(timeout=5)
+            for message in self.messages:
+                await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'read_receipt', 'message_id': message.id})})
+            receipt = json.loads((await communicator.receive_output(timeout=5))['text'])
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=5)
+
+        self.assertEqual(mark_read.call_count, 1)
+        self.assertEqual(receipt, {'type': 'read_receipt', 'user_id': self.receiver.pk, 'message_id': self.messages[-1].id})
+        self.assertEqual(await database_sync_to_async(self.watermark)(self.receiver), self.messages[-1].id)
+
+    @async_to_sync
+    async def test_socket_receipts_broadcast_the_stored_watermark(self):
+        scope = {
+            'type': 'websocket', 'path': f'/ws/chat/{self.conversation.pk}/', 'user': self.receiver,
+            'url_route': {'kwargs': {'conversation_id': str(self.conversation.pk)}},
+        }
+        communicator = ApplicationCommunicator(ChatConsumer.as_asgi(), scope)
+        with mock.patch.object(chat, 'READ_RECEIPT_DELAY', 0):
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(timeout=5)
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'read_receipt', 'message_id': 10 ** 9})})
+            receipt = json.loads((await communicator.receive_output(timeout=5))['text'])
+            # Already read up to the last message: nothing moves, nothing is sent
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'read_receipt', 'message_id': 10 ** 9 + 1})})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.3))
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=5)
+
+        self.assertEqual(receipt['message_id'], self.messages[-1].id)
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        chat.participants_cache.clear()
+        self.initiator = User.objects.create(username='initiator', email='initiator@emsi.ma')
+        self.receiver = User.objects.create(username='receiver', email='receiver@emsi.ma')
+        self.conversation = Conversation.objects.create(initiator=self.initiator, receiver=self.receiver)
+        self.ids = [
+            Message.objects.create(conversation=self.conversation, sender=self.initiator, content=f'ligne {i}').id
+            for i in range(10)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.receiver)
+        self.url = f'/api/conversation/{self.conversation.pk}/messages/'
+
+    def page(self, **params):
+        data = self.client.get(self.url, params).data
+        return [message['id'] for message in data['results']], data['before'], data['after']
+
+    def test_latest_page_and_scrolling_back(self):
+        ids, before, after = self.page(limit=4)
+        self.assertEqual((ids, before, after), (self.ids[6:], self.ids[6], None))
+
+        ids, before, after = self.page(limit=4, before_id=before)
+        self.assertEqual((ids, before, after), (self.ids[2:6], self.ids[2], self.ids[5]))
+
+        ids, before, _ = self.page(limit=4, before_id=before)
+        self.assertEqual((ids, before), (self.ids[:2], None))
+
+    def test_after_and_around(self):
+        self.assertEqual(self.page(limit=3, after_id=self.ids[2]), (self.ids[3:6], self.ids[3], self.ids[5]))
+        self.assertEqual(self.page(limit=3, after_id=self.ids[-1]), ([], None, None))
+        self.assertEqual(self.page(limit=4, around_id=self.ids[5]), (self.ids[3:7], self.ids[3], self.ids[6]))
+
+    def test_page_cost_does_not_grow_with_history(self):
+        # Conversation, watermarks, page
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {'limit': 5})
+        self.assertEqual(len(self.client.get(self.url).data), 10)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        chat.participants_cache.clear()
+        self.viewer = User.objects.create(username='viewer', email='viewer@emsi.ma')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def converse(self, count):
+        conversations = []
+        for i in range(count):
+            n = User.objects.count()
+            friend = User.objects.create(username=f'friend{n}', email=f'friend{n}@emsi.ma')
+            conversation = Conversation.objects.create(initiator=friend, receiver=self.viewer)
+            friend_client = APIClient()
+            friend_client.force_authenticate(friend)
+            for line in range(i + 1):
+                friend_client.post(f'/api/conversation/{conversation.pk}/messages/', {'content': f'ligne {line}'}, format='json')
+            conversations.append(conversation)
+        return conversations
+
+    def test_inbox_is_sorted_by_activity_with_counters(self):
+        first, second = self.converse(2)
+        self.client.post(f'/api/conversation/{first.pk}/messages/', {'content': 'réponse'}, format='json')
+
+        inbox = self.client.get('/api/conversations/').data
+
+        self.assertEqual([row['id'] for row in inbox], [first.pk, second.pk])
+        self.assertEqual(inbox[0]['last_message']['content'], 'réponse')
+        self.assertEqual([row['unread_count'] for row in inbox], [1, 2])
+
+        self.client.post(f'/api/conversation/{second.pk}/read/', {'message_id': 10 ** 9}, format='json')
+        self.assertEqual(self.client.get('/api/conversations/').data[1]['unread_count'], 0)
+
+    def test_paginated_inbox_costs_one_query(self):
+        self.converse(2)
+        with self.assertNumQueries(1):
+            self.client.get('/api/conversations/', {'limit': 10})
+        self.converse(5)
+        with self.assertNumQueries(1):
+            page = self.client.get('/api/conversations/', {'limit': 3}).data
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+
+    def test_socket_messages_and_deletes_update_the_inbox(self):
+        conversation, = self.converse(1)
+        friend = conversation.initiator
+
+        async def send():
+            return await chat.MessageWriter().write(Message(conversation=conversation, sender=friend, content='salut'))
+
+        message = async_to_sync(send)()
+        inbox = ConversationParticipant.objects.get(conversation=conversation, user=self.viewer)
+        self.assertEqual((inbox.last_message_id, inbox.unread_count), (message.id, 2))
+
+        friend_client = APIClient()
+        friend_client.force_authenticate(friend)
+        friend_client.delete(f'/api/conversation/{conversation.pk}/messages/{message.id}/')
+        inbox.refresh_from_db()
+        self.assertEqual((inbox.last_message_id, inbox.unread_count), (message.id - 1, 1))
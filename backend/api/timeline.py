@@ -0,0 +1,137 @@
+"""
+Materialized home timelines (fan-out on write).
+
+Creating a post copies a TimelineEntry into the feed of everyone who can
+see it: every user for a public post, and the members and admin of the
+group for a group post. Reading the feed is then a range scan over the
+reader's own entries. The fan-out runs once the post's transaction has
+committed, outside of it.
+
+Trimming is kept off the write path: timelines may run past MAX_LENGTH
+until `manage.py rebuild_timelines --trim-only` runs (schedule it
+periodically), and the unpaginated feed never shows more than MAX_LENGTH.
+
+Every change to a user's entries bumps their `timeline:<id>` response cache
+version, which their cached home feed pages depend on. A public post
+reaches everyone, so it bumps the one shared PUBLIC_TIMELINE version
+instead of a version per user.
+"""
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .cache import response_cache
+from .models import Groupe, Posts, TimelineEntry, User
+
+MAX_LENGTH = getattr(settings, 'TIMELINE_MAX_LENGTH', 500)
+BATCH_SIZE = 1000
+PUBLIC_TIMELINE = 'timeline:public'
+
+
+def audience(post):
+    """Ids of the users whose home timeline should show `post`."""
+    if post.groupe_id is None:
+        return User.objects.filter(is_active=True).values_list('id', flat=True).iterator(chunk_size=BATCH_SIZE)
+
+    groupe = Groupe.objects.only('admin_id').get(pk=post.groupe_id)
+    user_ids = set(groupe.users.values_list('id', flat=True))
+    user_ids.update(user_id for user_id in (groupe.admin_id, post.user_id) if user_id is not None)
+    return user_ids
+
+
+def visible_posts(user):
+    """Public posts plus posts from the groups `user` belongs to or runs."""
+    return Posts.objects.filter(
+        Q(groupe__isnull=True) | Q(groupe__users=user) | Q(groupe__admin=user) | Q(user=user)
+    ).distinct()
+
+
+def changed(user_ids):
+    """Invalidate the cached home feeds of these users."""
+    response_cache.bump(*(f'timeline:{user_id}' for user_id in user_ids))
+
+
+def write_entries(entries):
+    """Insert `entries` in batches."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    user_ids = audience(post)
+    write_entries(
+        TimelineEntry(user_id=user_id, post_id=post.pk, date_creation=post.date_creation)
+        for user_id in user_ids
+    )
+    if post.groupe_id is None:
+        response_cache.bump(PUBLIC_TIMELINE)
+    else:
+        changed(user_ids)
+
+
+def backfill(user, groupe=None):
+    """
+    Copy the newest visible posts into `user`'s timeline, either all of
+    them (new account) or only those of `groupe` (after joining it).
+    """
+    posts = Posts.objects.filter(groupe=groupe) if groupe is not None else visible_posts(user)
+    latest = posts.order_by('-date_creation', '-id').values_list('id', 'date_creation')[:MAX_LENGTH]
+    write_entries(
+        TimelineEntry(user=user, post_id=post_id, date_creation=date_creation)
+        for post_id, date_creation in latest
+    )
+    changed([user.pk])
+    trim(user)
+
+
+def remove_group(user, groupe):
+    TimelineEntry.objects.filter(user=user, post__groupe=groupe).exclude(post__user=user).delete()
+    changed([user.pk])
+
+
+def trim(user):
+    """Drop everything past the newest MAX_LENGTH entries of `user`'s timeline."""
+    oldest_kept = list(
+        TimelineEntry.objects.filter(user=user)
+        .order_by('-date_creation', '-post_id')
+        .values_list('date_creation', 'post_id')[MAX_LENGTH - 1:MAX_LENGTH]
+    )
+    if not oldest_kept:
+        return 0
+    date_creation, post_id = oldest_kept[0]
+    deleted, _ = TimelineEntry.objects.filter(
+        Q(date_creation__lt=date_creation) | Q(date_creation=date_creation, post_id__lt=post_id),
+        user=user,
+    ).delete()
+    if deleted:
+        changed([user.pk])
+    return deleted
+
+
+def trim_many(user_ids):
+    """
+    trim() for a batch of users at once: one windowed query finds the entries
+    past each user's newest MAX_LENGTH, and they are deleted by primary key.
+    """
+    ranked = TimelineEntry.objects.filter(user_id__in=user_ids).annotate(position=Window(
+        RowNumber(),
+        partition_by=F('user_id'),
+        order_by=[F('date_creation').desc(), F('post_id').desc()],
+    ))
+    stale = list(ranked.filter(position__gt=MAX_LENGTH).values_list('pk', 'user_id'))
+    for start in range(0, len(stale), BATCH_SIZE):
+        TimelineEntry.objects.filter(pk__in=[pk for pk, _ in stale[start:start + BATCH_SIZE]]).delete()
+    changed({user_id for _, user_id in stale})
+    return len(stale)
+
+
+def posts_for(entries):
+    """Posts for a page of timeline entries, in timeline order."""
+    post_ids = [entry.post_id for entry in entries]
+    posts = Posts.objects.for_serializer().in_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
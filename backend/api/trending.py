@@ -0,0 +1,134 @@
+"""
+Trending posts, ranked by time-decayed engagement.
+
+Every like, comment and save adds its weight to the post's score, and a
+score halves every HALF_LIFE seconds. Instead of decaying every row on a
+schedule, PostScore stores
+
+    rank_key = ln(sum(weight * e^(RATE * t)))
+
+over the post's events, with t counted from a fixed epoch. The current
+score is e^(rank_key - RATE * now): the same factor for every post, so
+ordering by rank_key is ordering by current score, and an event is one
+UPDATE folding its term in with a log-sum-exp. Unlikes and deletions take
+their weight back at the current time.
+
+Reads go through an in-process top-K list refreshed from the rank_key index
+every REFRESH seconds. `manage.py prune_trending` drops the scores that have
+decayed below MIN_SCORE.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from .cache import LRUCache
+from .models import Commentaire, Likes, PostScore, Posts, SavedPost
+
+OPTIONS = getattr(settings, 'TRENDING', {})
+HALF_LIFE = OPTIONS.get('HALF_LIFE', 6 * 3600)
+TOP_K = OPTIONS.get('TOP_K', 100)
+MIN_SCORE = OPTIONS.get('MIN_SCORE', 0.05)
+BATCH_SIZE = 1000
+
+# Activity model -> weight of one event
+WEIGHTS = {
+    Likes: OPTIONS.get('LIKE_WEIGHT', 1.0),
+    Commentaire: OPTIONS.get('COMMENT_WEIGHT', 3.0),
+    SavedPost: OPTIONS.get('SAVE_WEIGHT', 2.0),
+}
+
+RATE = math.log(2) / HALF_LIFE
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+top_posts = LRUCache(max_entries=1, timeout=OPTIONS.get('REFRESH', 30))
+
+
+def clock(when=None):
+    return ((when or timezone.now()) - EPOCH).total_seconds()
+
+
+def event_key(weight, when=None):
+    """rank_key of a post whose only event is one of `weight` at `when`."""
+    return math.log(weight) + RATE * clock(when)
+
+
+def score(rank_key, when=None):
+    """Current score of a post from its rank_key."""
+    return math.exp(rank_key - RATE * clock(when))
+
+
+def record(post_id, weight, when=None):
+    """Add an event to a post's score. Only public posts are ranked."""
+    key = Value(event_key(weight, when), output_field=FloatField())
+    # ln(e^a + e^b) = max(a, b) + ln(1 + e^-|a - b|), which cannot overflow
+    combined = Greatest(F('rank_key'), key) + Ln(1 + Exp(-Abs(F('rank_key') - key)))
+    if PostScore.objects.filter(post_id=post_id).update(rank_key=combined):
+        return
+    if not Posts.objects.filter(pk=post_id, groupe__isnull=True).exists():
+        return
+    try:
+        with transaction.atomic():
+            PostScore.objects.create(post_id=post_id, rank_key=key.value)
+    except IntegrityError:
+        # A concurrent event created the row first
+        PostScore.objects.filter(post_id=post_id).update(rank_key=combined)
+
+
+def retract(post_id, weight, when=None):
+    """Take an event back out of a post's score."""
+    key = Value(event_key(weight, when), output_field=FloatField())
+    scores = PostScore.objects.filter(post_id=post_id)
+    # ln(e^a - e^b) = a + ln(1 - e^(b - a)); a score that would not stay positive is dropped
+    scores.filter(rank_key__lte=key.value).delete()
+    scores.filter(rank_key__gt=key.value).update(rank_key=F('rank_key') + Ln(1 - Exp(key - F('rank_key'))))
+
+
+def top_ids():
+    """Ids of the TOP_K highest scored posts, at most REFRESH seconds old."""
+    ids = top_posts.get('ids')
+    if ids is None:
+        ids = list(
+            PostScore.objects.filter(rank_key__gte=event_key(MIN_SCORE))
+            .order_by('-rank_key')
+            .values_list('post_id', flat=True)[:TOP_K]
+        )
+        top_posts.set('ids', ids)
+    return ids
+
+
+def prune(when=None):
+    """Delete the scores that have decayed below MIN_SCORE; returns how many."""
+    deleted, _ = PostScore.objects.filter(rank_key__lt=event_key(MIN_SCORE, when)).delete()
+    return deleted
+
+
+def rebuild():
+    """
+    Recompute every score from the post counters. Activity rows carry no
+    timestamp, so each post's events are dated at the post's creation.
+    """
+    PostScore.objects.all().delete()
+    posts = (
+        Posts.objects.filter(groupe__isnull=True)
+        .filter(Q(likes_count__gt=0) | Q(comments_count__gt=0) | Q(saves_count__gt=0))
+        .only('date_creation', 'likes_count', 'comments_count', 'saves_count')
+    )
+    batch = []
+    for post in posts.iterator(chunk_size=BATCH_SIZE):
+        weight = (
+            post.likes_count * WEIGHTS[Likes]
+            + post.comments_count * WEIGHTS[Commentaire]
+            + post.saves_count * WEIGHTS[SavedPost]
+        )
+        batch.append(PostScore(post_id=post.pk, rank_key=event_key(weight, post.date_creation)))
+        if len(batch) >= BATCH_SIZE:
+            PostScore.objects.bulk_create(batch)
+            batch = []
+    PostScore.objects.bulk_create(batch)
+    top_posts.clear()
+    return posts.count()
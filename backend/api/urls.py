@@ -23,6 +23,8 @@ urlpatterns = [
     path('users/<int:pk>/update/', views.UserUpdateAPIView.as_view(), name='user_update'),
     path('posts/', views.PostsListAPIView.as_view(), name='posts_list'),
     path('posts/create/', views.PostsCreateAPIView.as_view(), name='posts_create'),
+    path('posts/status/', views.PostsStatusAPIView.as_view(), name='posts_status'),
+    path('posts/trending/', views.TrendingPostsAPIView.as_view(), name='posts_trending'),
     path('posts/<int:pk>/delete/', views.PostsDetailAPIView.as_view(), name='posts_delete'),
     path('posts/<int:pk>/', views.PostsDetailAPIView.as_view(), name='post_detail'),
     path('posts/<int:pk>/like/', views.LikePostAPIView.as_view(), name='like_post'), 
@@ -30,6 +32,7 @@ urlpatterns = [
     path('posts/<int:pk>/comments/', views.CommentListAPIView.as_view(), name='comments_list'),
     path('posts/<int:pk>/comments/<int:comment_id>/', views.CommentListAPIView.as_view(), name='comment-detail'),
     path('posts/<int:pk>/comments/create/', views.CommentListAPIView.as_view(), name='comments_create'),
+    path('comments/preview/', views.CommentPreviewAPIView.as_view(), name='comments_preview'),
     path('post/user/<int:user_id>/', views.UserPostsView.as_view(), name='user-posts'),
     path('posts/<int:pk>/save/', views.SavePostAPIView.as_view(), name='save-post'),
     path('saved-posts/', views.SavedPostsListAPIView.as_view(), name='saved-posts-list'),
@@ -38,11 +41,13 @@ urlpatterns = [
     path('ressources/<int:pk>/', views.RessourceAPIView.as_view(), name='ressources-delete'),
     path('posts/search/', views.search_posts, name='search_posts'),
     path('users/search/', views.search_users, name='search_users'),
+    path('search/', views.SearchAPIView.as_view(), name='search'),
+    path('search/stats/', views.SearchStatsAPIView.as_view(), name='search_stats'),
 
 
 
         path('groups/', views.GroupAPIView.as_view(), name='group-list'),
-        path('groups/search/', views.GroupAPIView.as_view(), name='group-search'),
+        path('groups/search/', views.search_groups, name='group-search'),
         path('groups/<int:pk>/', views.GroupAPIView.as_view(), name='group-detail'),
         path('groups/<int:pk>/add-members/', views.GroupAddMembersAPIView.as_view(), name='group-add-members'),
         path('groups/<int:pk>/posts/', views.GroupDetailAPIView.as_view(), name='group-posts'),
@@ -4,9 +4,10 @@ from django.contrib.auth.hashers import make_password,check_password
 from django.core.mail import send_mail
 from rest_framework import status, permissions,viewsets
 from rest_framework.response import Response
+from rest_framework.exceptions import APIException
 from rest_framework.views import APIView
-from .models import User, Token, Posts, Likes, Commentaire,SavedPost,Ressources,Groupe,Message,Conversation,Reports
-from .serializers import UserSerializer,PostsSerializer,TokenSerializer, MyTokenObtainPairSerializer,CommentsSerializer,SavedPostSerializer,RessourceSerializer,GroupeSerializer,MessageSerializer,ConversationSerializer,ReportsListSerializer,ReportsCreateSerializer
+from .models import User, Token, Posts, Likes, Commentaire,SavedPost,Ressources,Groupe,Message,Conversation,ConversationParticipant,Reports,TimelineEntry,AUTHOR_FIELDS,author_deferred
+from .serializers import users_table, UserSerializer,PostsSerializer,TokenSerializer, MyTokenObtainPairSerializer,CommentsSerializer,SavedPostSerializer,RessourceSerializer,GroupeSerializer,MessageSerializer,ConversationSerializer,ReportsListSerializer,ReportsCreateSerializer,GroupSearchSerializer,AuthorSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.conf import settings
 from django.shortcuts import get_object_or_404
@@ -14,19 +15,108 @@ from django.http import Http404
 from datetime import  timedelta
 from rest_framework.decorators import action
 import hashlib
-from django.db.models import Q
+from django.db.models import Count, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum
 import uuid
+from functools import partial
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.utils import timezone
 from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from .pagination import CommentPagination, InboxPagination, KeysetPagination, MessagePagination, RankedPagination, TimelinePagination
+from . import chat, search, timeline, trending
+from .cache import response_cache
+from .conditional import make_etag, not_modified, with_validators
+from .streaming import StreamingJSONListResponse
 
 SALT = "8b4f6b2cc1868d75ef79e5cfb8779c11b6a374bf0fce05b485581bf4e1e25b96c8c2855015de8449"
 URL = "http://localhost:5173"
 
 
+def sparse_fields(request):
+    """Field names asked for with ?fields=a,b, or None for all of them"""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',') if name.strip()}
+
+
+def list_context(request, context=None):
+    """
+    Serializer context for list endpoints: ?fields= sparse fieldsets and,
+    with ?normalize=users, an authors side table (see NormalizedAuthorMixin)
+    """
+    context = dict(context or {})
+    context['fields'] = sparse_fields(request)
+    if request.query_params.get('normalize') == 'users':
+        context['users'] = {}
+    return context
+
+
+def list_payload(data, context):
+    """Wrap serialized rows with the authors side table when one was asked for"""
+    if context.get('users') is None:
+        return data
+    if not isinstance(data, dict):
+        data = {'results': data}
+    data['users'] = users_table(context)
+    return data
+
+
+def response_cache_key(request, *parts):
+    """Cache key for a response that depends on the viewer and the query string"""
+    return ':'.join([*map(str, parts), str(request.user.pk), request.GET.urlencode()])
+
+
+def in_rank_order(queryset, ids):
+    """The rows of `queryset` with these ids, in the order of `ids`"""
+    rows = queryset.in_bulk(ids)
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+def visible_post_cards(viewer):
+    """Posts ready for PostsSerializer, limited to those `viewer` is allowed to see"""
+    return Posts.objects.for_serializer().filter(pk__in=timeline.visible_posts(viewer).values('pk'))
+
+
+def group_cards():
+    """Groups with the columns GroupSearchSerializer reads and their member count"""
+    return (
+        Groupe.objects.select_related('admin')
+        .only('nom', 'bio', 'profile_picture', 'admin', 'admin__username')
+        .annotate(member_count=Count('users'))
+    )
+
+
+def ranked_search(request, index, query):
+    """
+    Ids of the best matches for `query` in a search index: the page asked
+    for with ?limit / ?cursor, with its paginator, or else the top ten.
+    """
+    paginator = RankedPagination()
+    ids = paginator.paginate_ranked(lambda offset, limit: index.search(query, offset, limit), request)
+    if ids is None:
+        return index.search(query), None
+    return ids, paginator
+
+
+def message_history(request, conversation, context):
+    """
+    Messages of a conversation: the page asked for with ?limit, ?before_id,
+    ?after_id or ?around_id, or else every message after ?since_id.
+    """
+    messages = Message.objects.filter(conversation=conversation).select_related('sender').defer(*author_deferred('sender'))
+    context['read_marks'] = chat.read_marks(conversation.pk)
+    paginator = MessagePagination()
+    page = paginator.paginate_queryset(messages, request)
+    if page is not None:
+        serializer = MessageSerializer(page, many=True, context=context)
+        return list_payload(paginator.get_paginated_response(serializer.data).data, context)
+    messages = messages.filter(id__gt=request.query_params.get('since_id', 0)).order_by('timestamp')
+    return list_payload(MessageSerializer(messages, many=True, context=context).data, context)
+
+
 def mail_template(content,button_url, button_text):
     return f"""<!DOCTYPE html>
             <html>
@@ -229,9 +319,7 @@ class UsersListAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self,request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return StreamingJSONListResponse(User.objects.all(), UserSerializer)
     
 class UsersDetailAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -241,9 +329,17 @@ class UsersDetailAPIView(APIView):
         return get_object_or_404(User, pk=pk)
 
     def get(self, request, pk):
+        last_modified = User.objects.filter(pk=pk).values_list('date_modification', flat=True).first()
+        if last_modified is None:
+            raise Http404
+        etag = make_etag('user', pk, last_modified.isoformat())
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
         user = self.get_object(pk)
         serializer = UserSerializer(user)
-        return Response(serializer.data)
+        return with_validators(Response(serializer.data), etag, last_modified)
 
     def patch(self, request, pk):
         user = self.get_object(pk)
@@ -299,25 +395,87 @@ class PostsListAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        posts = Posts.objects.all().order_by('-date_creation')  
-        serializer = PostsSerializer(posts, many=True)
-        return Response(serializer.data)
+        """Home feed, read from the user's materialized timeline"""
+        cache_key = response_cache_key(request, 'feed')
+        data = response_cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+        # The page depends on the viewer's entries, then on each listed post
+        # and author, so activity elsewhere leaves it cached
+        versions = response_cache.versions(f'timeline:{request.user.pk}', timeline.PUBLIC_TIMELINE)
+        entries = (
+            TimelineEntry.objects.filter(user=request.user)
+            .annotate(author_id=F('post__user_id'))
+            .only('date_creation', 'post_id')
+        )
+
+        context = list_context(request, {'viewer': request.user})
+        paginator = TimelinePagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        rows = page if page is not None else list(entries.order_by('-date_creation', '-post_id')[:timeline.MAX_LENGTH])
+        versions.update(response_cache.versions(
+            *{f'post:{entry.post_id}' for entry in rows},
+            *{f'user:{entry.author_id}' for entry in rows},
+        ))
+        data = PostsSerializer(timeline.posts_for(rows), many=True, context=context).data
+        if page is not None:
+            data = paginator.get_paginated_response(data).data
+        data = list_payload(data, context)
+
+        response_cache.set(cache_key, data, versions)
+        return Response(data)
+
+
+class TrendingPostsAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """Public posts by decayed engagement, read from the cached top-K list"""
+        ids = trending.top_ids()
+        if 'limit' in request.query_params:
+            ids = ids[:KeysetPagination().get_limit(request.query_params)]
+
+        context = list_context(request, {'viewer': request.user})
+        serializer = PostsSerializer(in_rank_order(Posts.objects.for_serializer(), ids), many=True, context=context)
+        return Response(list_payload(serializer.data, context))
 
 
 class PostsDetailAPIView(APIView):
     def get_object(self, pk):
         return get_object_or_404(Posts, pk=pk)
 
+    def get_etag(self, request, pk):
+        row = Posts.objects.filter(pk=pk).values('version', 'user__date_modification').first()
+        if row is None:
+            raise Http404
+        return make_etag('post', pk, row['version'], row['user__date_modification'].isoformat(), request.user.pk)
+
     def get(self, request, pk):
+        etag = self.get_etag(request, pk)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        # The ETag carries the row versions read from the database, so a write
+        # signalled in another worker still misses this worker's cache
+        cache_key = response_cache_key(request, 'post', pk, etag)
+        data = response_cache.get(cache_key)
+        if data is not None:
+            return with_validators(Response(data), etag)
+
+        versions = response_cache.versions(f'post:{pk}')
         post = self.get_object(pk)
-        serializer = PostsSerializer(post)
-        return Response(serializer.data)
+        versions.update(response_cache.versions(f'user:{post.user_id}'))
+        data = PostsSerializer(post, context={'viewer': request.user}).data
+        response_cache.set(cache_key, data, versions)
+        return with_validators(Response(data), etag)
 
     def put(self, request, pk):
         post = self.get_object(pk)
-        serializer = PostsSerializer(post, data=request.data)
+        serializer = PostsSerializer(post, data=request.data, context={'viewer': request.user})
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(date_modification=timezone.now())
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -333,7 +491,7 @@ class LikePostAPIView(APIView):
     
     def get(self, request, pk):
         post = get_object_or_404(Posts, pk=pk)
-        serializer = PostsSerializer(post)
+        serializer = PostsSerializer(post, context={'viewer': request.user})
         return Response(serializer.data)
     
     def post(self, request, pk):
@@ -343,7 +501,9 @@ class LikePostAPIView(APIView):
         if Likes.objects.filter(post=post, user=user).exists():
             return Response({"message": "You have already liked this post."}, status=status.HTTP_400_BAD_REQUEST)
 
-        Likes.objects.create(post=post, user=user)
+        with transaction.atomic():
+            Likes.objects.create(post=post, user=user)
+        post.refresh_from_db(fields=['likes_count'])
         
         return Response({
             "message": "Post liked successfully!",
@@ -356,7 +516,9 @@ class LikePostAPIView(APIView):
 
         try:
             like = Likes.objects.get(post=post, user=user)
-            like.delete()
+            with transaction.atomic():
+                like.delete()
+            post.refresh_from_db(fields=['likes_count'])
             return Response({
                 "message": "Post unliked successfully!",
                 "num_likes": post.num_likes()
@@ -382,24 +544,86 @@ class LikeStatusAPIView(APIView):
         }, status=status.HTTP_200_OK)
     
 
+class PostsStatusAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_ids = 500
+
+    def post(self, request):
+        """Counts and the current user's like/save flags for a batch of posts"""
+        post_ids = request.data.get('ids', [])
+        if not isinstance(post_ids, list) or not post_ids:
+            return Response({"message": "A list of post ids is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(post_ids) > self.max_ids:
+            return Response(
+                {"message": f"At most {self.max_ids} post ids can be requested at once."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            post_ids = {int(post_id) for post_id in post_ids}
+        except (TypeError, ValueError):
+            return Response({"message": "Post ids must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        counts = timeline.visible_posts(request.user).filter(pk__in=post_ids).values('id', 'likes_count', 'comments_count', 'saves_count')
+        liked = set(Likes.objects.filter(user=request.user, post_id__in=post_ids).values_list('post_id', flat=True))
+        saved = set(SavedPost.objects.filter(user=request.user, post_id__in=post_ids).order_by().values_list('post_id', flat=True))
+
+        return Response({
+            "posts": [
+                {
+                    "id": post['id'],
+                    "num_likes": post['likes_count'],
+                    "num_comments": post['comments_count'],
+                    "save_count": post['saves_count'],
+                    "user_has_liked": post['id'] in liked,
+                    "user_has_saved": post['id'] in saved,
+                }
+                for post in counts
+            ]
+        }, status=status.HTTP_200_OK)
+    
+
 class CommentListAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, pk):
+        """
+        Comments oldest first. ?parent=<id> lists the replies to a comment and
+        ?parent=root only the top-level ones; ?limit / ?cursor page through them.
+        """
         post = get_object_or_404(Posts, pk=pk)
-        comments = post.comments.all()
-        serializer = CommentsSerializer(comments, many=True)
-        return Response(serializer.data)
+        comments = post.comments.for_serializer().order_by('date_creation', 'id')
+        parent = request.query_params.get('parent')
+        if parent == 'root':
+            comments = comments.filter(parent__isnull=True)
+        elif parent:
+            if not parent.isdigit():
+                return Response({"message": "parent must be a comment id or 'root'."}, status=status.HTTP_400_BAD_REQUEST)
+            comments = comments.filter(parent_id=parent)
+
+        context = list_context(request)
+        paginator = CommentPagination()
+        page = paginator.paginate_queryset(comments, request, view=self)
+        if page is not None:
+            serializer = CommentsSerializer(page, many=True, context=context)
+            return Response(list_payload(paginator.get_paginated_response(serializer.data).data, context))
+        serializer = CommentsSerializer(comments, many=True, context=context)
+        return Response(list_payload(serializer.data, context))
     
     def post(self, request, pk):
         post = get_object_or_404(Posts, pk=pk)
         user = request.user
         content = request.data.get("content")
+        parent_id = request.data.get("parent")
 
         if not content:
             return Response({"message": "Content is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if parent_id is not None:
+            if not str(parent_id).isdigit() or not post.comments.filter(pk=parent_id).exists():
+                return Response({"message": "Parent comment not found on this post."}, status=status.HTTP_400_BAD_REQUEST)
+            parent_id = int(parent_id)
         
-        comment = post.comments.create(user=user, content=content)
+        with transaction.atomic():
+            comment = post.comments.create(user=user, content=content, parent_id=parent_id)
         serializer = CommentsSerializer(comment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -430,23 +654,83 @@ class CommentListAPIView(APIView):
 
         try:
             comment = Commentaire.objects.get(post=post,user=user,id=commentaire.id)
-            comment.delete()
+            with transaction.atomic():
+                comment.delete()
             return Response({"message":"Comment deleted successfully!"},status=status.HTTP_200_OK)
         except Commentaire.DoesNotExist:
             return Response({"message":"Comment not found!"},status=status.HTTP_404_NOT_FOUND)
         
 
+class CommentPreviewAPIView(APIView):
+    """
+    The first few top-level comments of many posts at once, for feed cards:
+    GET comments/preview/?posts=1,2,3&count=3 -> {"1": [...], "2": [...], ...}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_posts = 100
+    default_count = 3
+    max_count = 10
+
+    def get(self, request):
+        try:
+            post_ids = [int(pk) for pk in request.query_params.get('posts', '').split(',') if pk]
+            count = int(request.query_params.get('count', self.default_count))
+        except ValueError:
+            return Response({"message": "posts must be a comma-separated list of ids."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(post_ids) > self.max_posts:
+            return Response({"message": f"At most {self.max_posts} posts per request."}, status=status.HTTP_400_BAD_REQUEST)
+        count = max(1, min(count, self.max_count))
+
+        visible = timeline.visible_posts(request.user).filter(pk__in=post_ids).values('pk')
+        comments = list(Commentaire.objects.first_per_post(visible, count))
+        context = list_context(request)
+        previews = {str(pk): [] for pk in post_ids}
+        for comment, data in zip(comments, CommentsSerializer(comments, many=True, context=context).data):
+            previews[str(comment.post_id)].append(data)
+        return Response(list_payload(previews, context))
+
+
 class UserPostsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    def get_etag(self, request, user_id):
+        # Every edit, like, comment or save bumps a post's version, so the
+        # sum moves on any change; count and max id catch deletes and inserts
+        rows = list(
+            User.objects.filter(pk=user_id)
+            .values('date_modification')
+            .annotate(count=Count('posts'), last_id=Max('posts__id'), versions=Sum('posts__version'))
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return make_etag(
+            'user_posts', user_id, row['date_modification'].isoformat(), row['count'], row['last_id'],
+            row['versions'], request.user.pk, request.GET.urlencode(),
+        )
+
     def get(self, request, user_id):
+        etag = self.get_etag(request, user_id)
+        if etag is not None:
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
 
         try:
+            cache_key = response_cache_key(request, 'user_posts', user_id, etag)
+            response_data = response_cache.get(cache_key)
+            if response_data is not None:
+                return with_validators(Response(response_data, status=status.HTTP_200_OK), etag)
+
+            versions = response_cache.versions(f'user:{user_id}', f'user_posts:{user_id}')
             user = get_object_or_404(User, id=user_id)
             
-            posts = Posts.objects.filter(user=user).order_by('-date_creation')
+            posts = Posts.objects.for_serializer().filter(user=user).order_by('-date_creation', '-id')
+
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(posts, request, view=self)
             
-            posts_serializer = PostsSerializer(posts, many=True, context={'request': request})
+            posts_serializer = PostsSerializer(posts if page is None else page, many=True, context={'request': request, 'viewer': request.user, 'fields': sparse_fields(request)})
             
             user_serializer = UserSerializer(user)
             
@@ -454,9 +738,14 @@ class UserPostsView(APIView):
                 'user': user_serializer.data,
                 'posts': posts_serializer.data
             }
+            if page is not None:
+                response_data['next'] = paginator.next_cursor
             
-            return Response(response_data, status=status.HTTP_200_OK)
+            response_cache.set(cache_key, response_data, versions)
+            return with_validators(Response(response_data, status=status.HTTP_200_OK), etag)
             
+        except (Http404, APIException):
+            raise
         except Exception as e:
             return Response(
                 {'error': f'Failed to fetch user posts: {str(e)}'},
@@ -475,7 +764,8 @@ class SavePostAPIView(APIView):
         if SavedPost.objects.filter(post=post, user=user).exists():
             return Response({"message": "You have already saved this post"}, status=status.HTTP_400_BAD_REQUEST)
         
-        SavedPost.objects.create(post=post, user=user)
+        with transaction.atomic():
+            SavedPost.objects.create(post=post, user=user)
         
         return Response({
             "message": "Post saved successfully!",
@@ -488,7 +778,8 @@ class SavePostAPIView(APIView):
         
         try:
             saved_post = SavedPost.objects.get(post=post, user=user)
-            saved_post.delete()
+            with transaction.atomic():
+                saved_post.delete()
             return Response({
                 "message": "Post unsaved successfully!"
             }, status=status.HTTP_200_OK)
@@ -502,9 +793,9 @@ class SavedPostsListAPIView(APIView):
     def get(self, request):
         """Get all posts saved by the current user"""
         user = request.user
-        saved_posts = SavedPost.objects.filter(user=user)
+        saved_posts = SavedPost.objects.filter(user=user).select_related('post__user')
 
-        serializer = SavedPostSerializer(saved_posts, many=True)
+        serializer = SavedPostSerializer(saved_posts, many=True, context={'viewer': request.user})
         return Response(serializer.data)
 
 
@@ -533,9 +824,8 @@ class RessourceAPIView(APIView):
         except Ressources.DoesNotExist:
             raise Http404
     def get(self, request):
-        ressources = Ressources.objects.all()
-        serializer = RessourceSerializer(ressources, many=True, context={'request': request})
-        return Response(serializer.data)
+        ressources = Ressources.objects.select_related('user').defer('search_document', *author_deferred('user'))
+        return StreamingJSONListResponse(ressources, RessourceSerializer, context={'request': request, 'fields': sparse_fields(request)})
 
     def post(self, request):
         serializer = RessourceSerializer(data=request.data, context={'request': request})
@@ -563,11 +853,11 @@ def search_posts(request):
     if not query:
         return Response([])
     
-    posts = Posts.objects.filter(
-        Q(contenu_texte__icontains=query) | 
-        Q(user__username__icontains=query) 
-    ).select_related('user').order_by('-date_creation')[:10]
-    serializer = PostsSerializer(posts, many=True)
+    ids, paginator = ranked_search(request, search.posts, query)
+    posts = in_rank_order(visible_post_cards(request.user), ids)
+    serializer = PostsSerializer(posts, many=True, context={'viewer': request.user, 'fields': sparse_fields(request)})
+    if paginator is not None:
+        return paginator.get_paginated_response(serializer.data)
     return Response(serializer.data)
 
 @api_view(['GET'])
@@ -577,28 +867,81 @@ def search_users(request):
     if not query:
         return Response([])
     
-    users = User.objects.filter(
-        Q(username__icontains=query)
-    )[:10]
-    
+    users = in_rank_order(User.objects.all(), search.users.search(query))
     serializer = UserSerializer(users, many=True)
     return Response(serializer.data)
 
-# @api_view(['GET'])
-# @permission_classes([permissions.IsAuthenticated])
-# def search_groups(request):
-#     query = request.query_params.get('query', '')
-#     if not query:
-#         return Response([])
-    
-#     # Search in group name and description
-#     groups = Group.objects.filter(
-#         Q(name__icontains=query) | 
-#         Q(description__icontains=query)
-#     )[:10]  # Limit to 10 results
-    
-#     serializer = GroupSerializer(groups, many=True)
-#     return Response(serializer.data)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search_groups(request):
+    query = request.query_params.get('query', '')
+    if not query:
+        return Response([])
+
+    # Search in group name and description
+    ids, paginator = ranked_search(request, search.groups, query)
+    serializer = GroupSearchSerializer(in_rank_order(group_cards(), ids), many=True, context={'fields': sparse_fields(request)})
+    if paginator is not None:
+        return paginator.get_paginated_response(serializer.data)
+    return Response(serializer.data)
+
+
+class SearchAPIView(APIView):
+    """
+    GET search/?query=... looks the query up in posts, users, groups and
+    resources at the same time and answers with one ranked section per type:
+    {"query": ..., "sections": [{"type": "posts", "status": "ok", "results": [...]}, ...]}.
+    A section that misses its time budget comes back with status "timeout"
+    and no results. ?types=posts,users narrows the sections and ?limit sets
+    their size.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    section_types = ('posts', 'users', 'groups', 'resources')
+    default_limit = 5
+    max_limit = 20
+
+    def get(self, request):
+        query = request.query_params.get('query', '')
+        types = request.query_params.get('types')
+        types = [name for name in self.section_types if types is None or name in types.split(',')]
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            limit = self.default_limit
+        if not query:
+            return Response({'query': query, 'sections': []})
+
+        fields = sparse_fields(request)
+        tasks = {name: partial(getattr(self, f'search_{name}'), request.user, query, limit, fields) for name in types}
+        sections = []
+        for name, (outcome, results) in search.gather(tasks).items():
+            sections.append({'type': name, 'status': outcome, 'results': results or []})
+        return Response({'query': query, 'sections': sections})
+
+    def search_posts(self, viewer, query, limit, fields):
+        posts = in_rank_order(visible_post_cards(viewer), search.posts.search(query, limit=limit))
+        return PostsSerializer(posts, many=True, context={'viewer': viewer, 'fields': fields}).data
+
+    def search_users(self, viewer, query, limit, fields):
+        users = in_rank_order(User.objects.only(*AUTHOR_FIELDS), search.users.search(query, limit=limit))
+        return AuthorSerializer(users, many=True).data
+
+    def search_groups(self, viewer, query, limit, fields):
+        groups = in_rank_order(group_cards(), search.groups.search(query, limit=limit))
+        return GroupSearchSerializer(groups, many=True, context={'fields': fields}).data
+
+    def search_resources(self, viewer, query, limit, fields):
+        resources = Ressources.objects.select_related('user').defer('search_document', *author_deferred('user'))
+        resources = in_rank_order(resources, search.resources.search(query, limit=limit))
+        return RessourceSerializer(resources, many=True, context={'fields': fields}).data
+
+
+class SearchStatsAPIView(APIView):
+    """Hit ratio and size of the search result cache, for tuning SEARCH['CACHE_*']"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(search.search_cache.stats())
 
 
 class GroupAPIView(APIView):
@@ -611,8 +954,13 @@ class GroupAPIView(APIView):
             
             # Check if user is a member or admin
             if request.user == groupe.admin or request.user in groupe.users.all():
+                etag, last_modified = self.get_validators(groupe)
+                response = not_modified(request, etag, last_modified)
+                if response is not None:
+                    return response
+
                 serializer = GroupeSerializer(groupe)
-                return Response(serializer.data)
+                return with_validators(Response(serializer.data), etag, last_modified)
             
             
                 
@@ -634,9 +982,27 @@ class GroupAPIView(APIView):
                 member_groups = request.user.member_groups.all()
                 groups = (admin_groups | member_groups).distinct()
             
-            serializer = GroupeSerializer(groups, many=True)
+            groups = groups.select_related('admin').defer('search_document', *author_deferred('admin')).prefetch_related(
+                Prefetch('users', queryset=User.objects.only(*AUTHOR_FIELDS))
+            )
+            serializer = GroupeSerializer(groups, many=True, context={'fields': sparse_fields(request)})
             return Response(serializer.data)
     
+    def get_validators(self, groupe):
+        # Membership changes touch the group's date_modification; member and
+        # admin profile edits show up through their own date_modification
+        related = Groupe.objects.filter(pk=groupe.pk).aggregate(
+            members=Count('users', distinct=True),
+            members_modified=Max('users__date_modification'),
+            admin_modified=Max('admin__date_modification'),
+        )
+        last_modified = max(
+            value for value in (groupe.date_modification, related['members_modified'], related['admin_modified'])
+            if value is not None
+        )
+        etag = make_etag('group', groupe.pk, last_modified.isoformat(), related['members'])
+        return etag, last_modified
+
     def post(self, request):
         data = request.data.copy()
         
@@ -692,10 +1058,16 @@ class GroupDetailAPIView(APIView):
     def get(self, request, pk):
         group = self.get_object(pk)
         
-        posts = Posts.objects.filter(groupe=group).order_by("-date_creation")
+        posts = Posts.objects.for_serializer().filter(groupe=group).order_by("-date_creation", "-id")
         
-        if request.user == group.admin or request.user in group.users.all():
-            serializer = PostsSerializer(posts,many=True)
+        if request.user.id == group.admin_id or group.users.filter(pk=request.user.pk).exists():
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(posts, request, view=self)
+            if page is not None:
+                serializer = PostsSerializer(page, many=True, context={'viewer': request.user, 'fields': sparse_fields(request)})
+                return paginator.get_paginated_response(serializer.data)
+
+            serializer = PostsSerializer(posts,many=True, context={'viewer': request.user, 'fields': sparse_fields(request)})
             return Response(serializer.data)
         
         return Response(
@@ -904,27 +1276,45 @@ class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
     def list(self, request, *args, **kwargs):
-
-        queryset = self.get_queryset()
+        """
+        The viewer's inbox, most recent activity first, read from their
+        ConversationParticipant rows: last message, unread count and the
+        other side's read watermark all come from one indexed query.
+        """
+        peer_read_id = (
+            ConversationParticipant.objects.filter(conversation=OuterRef('conversation'))
+            .exclude(user=OuterRef('user')).values('last_read_id')[:1]
+        )
+        inbox = (
+            ConversationParticipant.objects.filter(user=request.user)
+            .select_related('conversation__initiator', 'conversation__receiver', 'last_message__sender')
+            .annotate(peer_read_id=Subquery(peer_read_id))
+        )
         
         # Optional filtering
         search = request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(initiator__username__icontains=search) |
-                Q(receiver__username__icontains=search) |
-                Q(initiator__first_name__icontains=search) |
-                Q(receiver__first_name__icontains=search)
+            inbox = inbox.filter(
+                Q(conversation__initiator__username__icontains=search) |
+                Q(conversation__receiver__username__icontains=search) |
+                Q(conversation__initiator__first_name__icontains=search) |
+                Q(conversation__receiver__first_name__icontains=search)
             )
         
-        # Pagination
-        page = self.paginate_queryset(queryset)
+        paginator = InboxPagination()
+        page = paginator.paginate_queryset(inbox, request, view=self)
+        rows = page if page is not None else inbox.order_by('-last_activity', '-id')
+        serializer = self.get_serializer([self.with_inbox(row) for row in rows], many=True)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
+            return paginator.get_paginated_response(serializer.data)
         return Response(serializer.data)
+
+    def with_inbox(self, row):
+        conversation = row.conversation
+        conversation.inbox = row
+        peer_id = conversation.receiver_id if conversation.initiator_id == row.user_id else conversation.initiator_id
+        conversation.read_marks = {peer_id: row.peer_read_id or 0, row.user_id: row.last_read_id}
+        return conversation
     
     def get_queryset(self):
         return Conversation.objects.filter(
@@ -959,38 +1349,33 @@ class ConversationViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         conversation = self.get_object()
-        since_id = request.query_params.get('since_id', 0)
-        
-        messages = Message.objects.filter(
-            conversation=conversation,
-            id__gt=since_id
-        ).order_by('timestamp')
-        
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        return Response(message_history(request, conversation, {'fields': sparse_fields(request)}))
     
     @action(detail=True, methods=['post'])
-    def read(self, request, pk=None):
-        conversation = self.get_object()
-        message_ids = request.data.get('message_ids', [])
-        
-        if not message_ids:
-            return Response({"error": "message_ids are required"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Only mark messages as read if they were sent to the current user
-        messages = Message.objects.filter(
-            id__in=message_ids,
-            conversation=conversation,
-            sender__not=request.user
-        )
+    def read(self, request, pk=None, conversation_pk=None):
+        # Routed both as conversation/<pk>/read/ and conversation/<conversation_pk>/read/
+        conversation = get_object_or_404(self.get_queryset(), pk=pk or conversation_pk)
+        message_id = request.data.get('message_id')
+        try:
+            if message_id is None:
+                # Clients that list the ids they have seen read up to the newest one
+                message_id = max(map(int, request.data.get('message_ids') or [0]))
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            message_id = 0
+        if message_id <= 0:
+            return Response({"error": "message_id is required"}, status=status.HTTP_400_BAD_REQUEST)
         
-        updated_count = messages.update(read=True)
-        return Response({"updated": updated_count})
+        chat.mark_read(conversation.pk, request.user.pk, message_id)
+        return Response({"last_read_id": chat.read_marks(conversation.pk).get(request.user.pk, 0)})
 
 
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+
+    def get_serializer_context(self):
+        return list_context(self.request, super().get_serializer_context())
     
     def get_object(self, pk=None):
         # Fix: Add default parameter and proper error handling
@@ -1022,14 +1407,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             pk=conversation_pk
         )
         
-        since_id = request.query_params.get('since_id', 0)
-        messages = Message.objects.filter(
-            conversation=conversation,
-            id__gt=since_id
-        ).order_by('timestamp')
-        
-        serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+        return Response(message_history(request, conversation, self.get_serializer_context()))
     
     def create(self, request, conversation_pk=None):
         conversation = get_object_or_404(
@@ -1044,7 +1422,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             sender=request.user,
             content=request.data.get('content', '')
         )
-        message.save()
+        with transaction.atomic():
+            message.save()
+            chat.record_messages([message])
         
         serializer = self.get_serializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -1061,6 +1441,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             )
         
         message.delete()
+        chat.refresh_inbox(message.conversation_id)
         return Response(
             {"message": "Message deleted successfully"}, 
             status=status.HTTP_200_OK
@@ -1071,16 +1452,22 @@ class ReportsAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        reports = Reports.objects.all()
-        unique_reports = []
-        seen_ids = set()
-
-        for report in reports:
-            if report.post_reported.id not in seen_ids:
-                unique_reports.append(report)
-                seen_ids.add(report.post_reported.id)
-        serializer = ReportsListSerializer(unique_reports, many=True)
-        return Response(serializer.data)
+        # One row per reported post (its first report), with the number of
+        # reports against that post counted in the same query
+        first_reports = Reports.objects.values('post_reported').annotate(first_id=Min('id')).values('first_id')
+        reports_per_post = (
+            Reports.objects.filter(post_reported=OuterRef('post_reported'))
+            .order_by()
+            .values('post_reported')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        reports = (
+            Reports.objects.filter(id__in=first_reports)
+            .select_related('post_reported__user', 'user_reported')
+            .annotate(reports_count=Subquery(reports_per_post))
+        )
+        return StreamingJSONListResponse(reports, ReportsListSerializer)
     
     def post(self, request):
         serializer = ReportsCreateSerializer(data=request.data, context={"request": request})
@@ -48,9 +48,17 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'backend.asgi.application'
 
+# Chat messages go through the database (api/layers.py) so every ASGI worker
+# sees every group; channels.layers.InMemoryChannelLayer is enough when only
+# one worker runs.
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'api.layers.DatabaseChannelLayer',
+        'CONFIG': {
+            'expiry': 60,
+            'group_expiry': 86400,
+            'capacity': 100,
+        },
     },
 }
 CSRF_TRUSTED_ORIGINS = ['http://localhost:5173/']
@@ -158,7 +166,7 @@ MEDIA_URL = '/media/'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ],
 }
 
@@ -174,4 +182,65 @@ SIMPLE_JWT = {
 }
 
 
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
\ No newline at end of file
+# Per-process caches of validated access tokens and their users
+# (api/authentication.py). A user's entry is dropped when the user is saved
+# in this process; other processes see the change within TIMEOUT seconds.
+AUTH_CACHE = {
+    'TOKEN_ENTRIES': 10000,
+    'USER_ENTRIES': 10000,
+    'TIMEOUT': 300,
+}
+
+# Chat (api/chat.py): conversation participants are cached per process;
+# socket messages are saved in batches of up to MAX_BATCH, gathered for
+# FLUSH_DELAY seconds; read receipts from a socket are written and
+# broadcast at most once per READ_RECEIPT_DELAY seconds
+CHAT = {
+    'PARTICIPANT_ENTRIES': 10000,
+    'PARTICIPANT_TIMEOUT': 3600,
+    'FLUSH_DELAY': 0.002,
+    'MAX_BATCH': 100,
+    'READ_RECEIPT_DELAY': 0.5,
+}
+
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# Number of posts kept in each user's materialized home timeline; posting
+# does not trim, so run `manage.py rebuild_timelines --trim-only` periodically
+TIMELINE_MAX_LENGTH = 500
+
+# Versioned cache for feed and post responses (api/cache.py). 'lru' keeps a
+# bounded per-process cache; 'django' uses the cache named by ALIAS.
+RESPONSE_CACHE = {
+    'BACKEND': 'lru',
+    'MAX_ENTRIES': 1000,
+    'TIMEOUT': 60,
+}
+
+# Trending posts (api/trending.py): scores halve every HALF_LIFE seconds and
+# the top TOP_K list is re-read every REFRESH seconds
+TRENDING = {
+    'HALF_LIFE': 6 * 3600,
+    'TOP_K': 100,
+    'REFRESH': 30,
+    'MIN_SCORE': 0.05,
+    'LIKE_WEIGHT': 1.0,
+    'COMMENT_WEIGHT': 3.0,
+    'SAVE_WEIGHT': 2.0,
+}
+
+# Post search index (api/search.py): 'auto' uses MySQL FULLTEXT or SQLite
+# FTS5 when available and SearchTerm rows otherwise; 'fulltext', 'fts5' or
+# 'terms' force one. Run `manage.py rebuild_search_index` after changing it.
+# /api/search/ runs its sections on WORKERS threads and gives each of them
+# SECTION_TIMEOUT seconds. Result id lists are cached per process
+# (CACHE_ENTRIES, CACHE_TIMEOUT seconds); see /api/search/stats/.
+# FULLTEXT_MIN_TOKEN_SIZE must match MySQL's innodb_ft_min_token_size.
+SEARCH = {
+    'BACKEND': 'auto',
+    'WORKERS': 4,
+    'SECTION_TIMEOUT': 0.5,
+    'CACHE_ENTRIES': 1000,
+    'CACHE_TIMEOUT': 60,
+    'FULLTEXT_MIN_TOKEN_SIZE': 3,
+}
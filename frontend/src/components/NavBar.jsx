@@ -174,7 +174,15 @@ const NavBar = () => {
           author: post.user?.username  || "Unknown",
           date: new Date(post.date_creation).toLocaleDateString()
         })));
-      } 
+      }
+      else if (endpoint === '/groups/search/') {
+        setSearchResults(response.data.map(group => ({
+          id: group.id,
+          title: group.nom,
+          type: "group",
+          memberCount: group.member_count
+        })));
+      }
       
     } catch (error) {
       console.error("Search error:", error);
@@ -200,6 +208,8 @@ const NavBar = () => {
         return `/profile/${result.id}`;
       case "post":
         return `/posts/${result.id}`;
+      case "group":
+        return '/groups';
      
       default:
         return '/';
@@ -36,8 +36,8 @@ const PostCard = ({ post }) => {
   const navigate = useNavigate()
   const { theme } = useTheme();
   const isDarkTheme = theme === "dark";
-  const [liked, setLiked] = useState(false);
-  const [saved, setSaved] = useState(false);
+  const [liked, setLiked] = useState(post.user_has_liked || false);
+  const [saved, setSaved] = useState(post.user_has_saved || false);
   const [likeCount, setLikeCount] = useState(post.num_likes || 0);
   const [isLoading, setIsLoading] = useState(false);
   const [isSaveLoading, setIsSaveLoading] = useState(false);
@@ -126,8 +126,13 @@ const PostCard = ({ post }) => {
       }
     };
 
-    checkLikeStatus();
-    checkSaveStatus();
+    // Feed responses already carry the viewer's like/save state
+    if (post.user_has_liked === undefined) {
+      checkLikeStatus();
+    }
+    if (post.user_has_saved === undefined) {
+      checkSaveStatus();
+    }
   }, [post.id]);
 
   const handleCommentUpdated = (updatedComment) => {
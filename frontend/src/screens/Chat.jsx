@@ -127,12 +127,12 @@ const Chat = () => {
 
         // Only fetch messages with IDs higher than what we already have
         const response = await api.get(
-          `/api/conversation/${conversationId}/messages/?since_id=${latestMessageId}`
+          `/api/conversation/${conversationId}/messages/?after_id=${latestMessageId}&limit=100`
         );
 
         // Filter out messages we already have to avoid duplicates
         const existingMessageIds = new Set(messages.map((msg) => msg.id));
-        const newMessages = response.data.filter(
+        const newMessages = response.data.results.filter(
           (msg) => !existingMessageIds.has(msg.id)
         );
 
@@ -252,13 +252,14 @@ const Chat = () => {
     if (!conversationId) return;
 
     try {
+      // Only the latest page; older messages stay on the server
       const response = await api.get(
-        `/api/conversation/${conversationId}/messages/`
+        `/api/conversation/${conversationId}/messages/?limit=50`
       );
 
       // Replace all messages with the ones from the server
       // This ensures we don't get duplicates when reloading
-      setMessages(response.data);
+      setMessages(response.data.results);
     } catch (error) {
       console.error("Error loading messages:", error);
     }